@@ -0,0 +1,116 @@
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import Dict, List, Optional, Tuple
+
+import lol
+
+EXPORT_NAMES = ("citi.csv", "sidera.csv", "carriles.csv")
+
+def find_triplets(source: str) -> List[Tuple[str, str, str, str]]:
+    """
+    (site, citi, sidera, carriles) of every export triplet in `source`.
+    A directory holds one subdirectory per site with citi.csv, sidera.csv and
+    carriles.csv, as generate_data.py writes them. A file is a ;-separated
+    manifest with a site;citi;sidera;carriles header, paths relative to it.
+    """
+    if os.path.isdir(source):
+        triplets = []
+        for site in sorted(os.listdir(source)):
+            paths = [os.path.join(source, site, name) for name in EXPORT_NAMES]
+            if all(os.path.isfile(path) for path in paths):
+                triplets.append((site, *paths))
+        return triplets
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8', newline='') as f:
+        rows = csv.DictReader(f, delimiter=';')
+        return [(row['site'], *(os.path.join(base, row[name]) for name in ('citi', 'sidera', 'carriles')))
+                for row in rows]
+
+def reconcile_site(task: Tuple[str, str, str, str, str, Dict]) -> Tuple[str, Optional[lol.DebugStats], Optional[str], float]:
+    """
+    Run compare_files for one site in a worker process. Its console output
+    goes to <output>.log instead of interleaving with the other sites.
+    Returns the site, its stats (None if it failed), the error and the seconds taken.
+    """
+    site, citi_path, sidera_path, carriles_path, output_path, options = task
+    start = time.perf_counter()
+    log = io.StringIO()
+    try:
+        with redirect_stdout(log):
+            stats = lol.compare_files(citi_path, sidera_path, carriles_path, output_path=output_path, **options)
+        return site, stats, None, time.perf_counter() - start
+    except Exception as e:
+        return site, None, f"{type(e).__name__}: {e}", time.perf_counter() - start
+    finally:
+        with open(os.path.splitext(output_path)[0] + ".log", "w", encoding="utf-8") as f:
+            f.write(log.getvalue())
+
+def compare_batch(source: str, output_dir: str, workers: int = 1, output_format: str = "xlsx", **options) -> Dict:
+    """
+    Reconcile every triplet found in `source` on a process pool, writing
+    <output_dir>/<site>.<format> for each one and <output_dir>/summary.json
+    with the counters of each site and of all of them together. A failing
+    site is reported in the summary without stopping the others.
+    """
+    triplets = find_triplets(source)
+    os.makedirs(output_dir, exist_ok=True)
+    extension = lol.OUTPUT_FORMATS[output_format].extension
+    tasks = [(site, citi_path, sidera_path, carriles_path, os.path.join(output_dir, f"{site}.{extension}"),
+              dict(options, output_format=output_format))
+             for site, citi_path, sidera_path, carriles_path in triplets]
+    print(f"Reconciling {len(tasks)} sites with {workers} workers...")
+
+    total = lol.DebugStats()
+    summary = {'sites': {}, 'failed': {}, 'total': None}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # One site per task: sites are few and each one takes a while
+        for (site, stats, error, seconds), task in zip(pool.map(reconcile_site, tasks), tasks):
+            if stats is None:
+                print(f"  {site}: ERROR {error}")
+                summary['failed'][site] = error
+                continue
+            total.merge(stats)
+            summary['sites'][site] = dict(stats.to_dict(), output=task[4], seconds=seconds)
+            print(f"  {site}: {stats.total_citi} Citi, {stats.total_sidera} Sidera, "
+                  f"{stats.total_carriles} Carriles in {seconds:.2f} s")
+    summary['total'] = total.to_dict()
+
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Compare many Citi, Sidera, and Carriles triplets in one run')
+    parser.add_argument('source', help='Directory with one subdirectory per site, or a site;citi;sidera;carriles manifest')
+    parser.add_argument('output_dir', help='Directory for the outputs, their logs and summary.json')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Sites reconciled at once (default: CPU count)')
+    parser.add_argument('--format', dest='output_format', choices=list(lol.OUTPUT_FORMATS), default='xlsx',
+                        help='Output format (default: xlsx)')
+    parser.add_argument('--matcher', choices=sorted(lol.MATCHERS), default='sweep', help='Pairing strategy (default: sweep)')
+    parser.add_argument('--engine', choices=['objects', 'sqlite'], default='objects', help='Matching engine (default: objects)')
+    parser.add_argument('--write-only', action='store_true', help='Stream workbooks to disk with openpyxl write-only mode')
+    parser.add_argument('--no-raw-sheets', dest='raw_sheets', action='store_false',
+                        help='Leave the Citi, Sidera and Carriles sheets out of the workbooks')
+    parser.add_argument('--max-sheet-rows', type=lol.sheet_rows, default=lol.EXCEL_MAX_ROWS,
+                        help='Rows per raw source sheet before going on to a "<sheet> (2)" sheet (default: the Excel limit)')
+    parser.add_argument('--debug', action='store_true', help='Enable debug output in the site logs')
+    args = parser.parse_args()
+    conflict = lol.option_conflict(args.matcher, args.engine)
+    if conflict is not None:
+        parser.error(conflict)
+
+    summary = compare_batch(args.source, args.output_dir, args.workers, args.output_format, matcher=args.matcher,
+                            engine=args.engine, write_only=args.write_only, debug=args.debug,
+                            raw_sheets=args.raw_sheets, max_sheet_rows=args.max_sheet_rows)
+    total = summary['total']
+    print(f"\n{len(summary['sites'])} sites reconciled, {len(summary['failed'])} failed")
+    print("Tipos de coincidencia (todas las sedes):")
+    for match_type, count in total['matches'].items():
+        print(f"  {match_type}: {count}")
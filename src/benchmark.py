@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+from typing import Dict, List
+
+import lol
+from generate_data import generate
+
+PHASES = ["parse", "pairing", "carriles", "sort", "write"]
+# DebugStats phases making up each column of the table
+PHASE_SOURCES = {
+    "parse": ["read", "parse"],
+    "pairing": ["pair"],
+    "carriles": ["carril_match"],
+    "sort": ["sort"],
+    "write": ["write"],
+}
+
+def run_pipeline(citi_path: str, sidera_path: str, carriles_path: str, output_path: str, matcher: str = "sweep",
+                 write_only: bool = True, max_write_rows: int = 1_000_000, engine: str = "objects") -> Dict[str, float]:
+    """
+    Run the reconciliation as compare_files does and return the seconds of
+    each column of the table, from the phases the pipeline records itself,
+    and the row counts
+    """
+    with lol.reconcile(citi_path, sidera_path, carriles_path, matcher=matcher, engine=engine) as result:
+        # Excel can't hold more than ~1M rows per sheet, and openpyxl takes ages before that
+        if result.row_count <= max_write_rows:
+            result.write(output_path, "xlsx", write_only)
+
+    phases = result.stats.phases
+    timings: Dict[str, float] = {}
+    for column, names in PHASE_SOURCES.items():
+        if any(name in phases for name in names):
+            timings[column] = sum(phases[name]['seconds'] for name in names if name in phases)
+    timings["input_rows"] = result.stats.total_citi + result.stats.total_sidera + result.stats.total_carriles
+    timings["output_rows"] = result.row_count
+    return timings
+
+def parse_size(size: str) -> int:
+    """'10k' -> 10000, '1M' -> 1000000"""
+    multipliers = {'k': 1_000, 'm': 1_000_000}
+    suffix = size[-1].lower()
+    if suffix in multipliers:
+        return int(float(size[:-1]) * multipliers[suffix])
+    return int(size)
+
+def print_table(results: List[Dict]) -> None:
+    print(f"{'size':>10} {'input rows':>11} " + " ".join(f"{phase:>9}" for phase in PHASES) + f" {'total':>9}")
+    for result in results:
+        timings = [result.get(phase) for phase in PHASES]
+        cells = " ".join(f"{t:9.2f}" if t is not None else f"{'-':>9}" for t in timings)
+        total = sum(t for t in timings if t is not None)
+        print(f"{result['size']:>10} {result['input_rows']:>11} {cells} {total:9.2f}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Time each phase of the reconciliation on synthetic exports')
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k', '1M', '10M'],
+                        help='Incidents per run, e.g. 10k 100k 1M (default: 10k 100k 1M 10M)')
+    parser.add_argument('--data-dir', default=None,
+                        help='Where to keep the generated exports, reused between runs (default: a temporary directory)')
+    parser.add_argument('--matcher', choices=sorted(lol.MATCHERS), default='sweep', help='Pairing strategy (default: sweep)')
+    parser.add_argument('--engine', choices=['objects', 'sqlite'], default='objects',
+                        help='Matching engine (default: objects)')
+    parser.add_argument('--standard-workbook', action='store_true', help='Time the regular openpyxl workbook instead of write-only')
+    parser.add_argument('--max-write-rows', type=int, default=1_000_000,
+                        help='Skip the XLSX phase above this many output rows (default: 1000000)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generator (default: 0)')
+    parser.add_argument('--json', dest='json_path', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        results = []
+        for size in args.sizes:
+            incidents = parse_size(size)
+            size_dir = os.path.join(data_dir, f"{incidents}-{args.seed}")
+            paths = [os.path.join(size_dir, name) for name in ("citi.csv", "sidera.csv", "carriles.csv")]
+            if not all(os.path.exists(path) for path in paths):
+                print(f"Generating {size} incidents in {size_dir}...")
+                paths = generate(size_dir, incidents=incidents, cameras=max(10, incidents // 2000), seed=args.seed)
+
+            print(f"Running {size}...")
+            result = run_pipeline(*paths, os.path.join(tmp, "benchmark.xlsx"), args.matcher,
+                                  not args.standard_workbook, args.max_write_rows, args.engine)
+            result["size"] = size
+            results.append(result)
+            print_table([result])
+
+        print()
+        print_table(results)
+        if args.json_path:
+            with open(args.json_path, "w") as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,103 @@
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+# Same layouts lol.py reads: ;-separated, iso-8859-1, one header row
+CITI_HEADER = ["CameraName", "Start", "IncType", "IncType", "TEXTO AÑOS", "TEXTO HORAS"]
+SIDERA_HEADER = ["Equipo", "Desc. variable", "Fecha", "TEXTO AÑOS", "TEXTO HORAS", "TEXTO SEGUNDOS"]
+CARRILES_HEADER = ["Equipo", "Desc. variable", "Fecha", "Hora"]
+
+DESCRIPTIONS = [
+    "Vehículo detenido",
+    "Peatón en calzada",
+    "Objeto en calzada",
+    "Contradirección",
+    "Humo",
+    "Congestión",
+    "Velocidad lenta",
+]
+
+def camera_ids(cameras: int, cameras_per_prefix: int) -> List[str]:
+    """Camera IDs where every `cameras_per_prefix` cameras share their 6-char prefix"""
+    return [f"TUN{n // cameras_per_prefix:02d}-C{n % cameras_per_prefix:02d}" for n in range(cameras)]
+
+def jittered(moment: datetime, rng: random.Random, jitter: int) -> datetime:
+    """Moment moved by up to `jitter` minutes and some seconds, as the other system logs it"""
+    return moment + timedelta(minutes=rng.randint(-jitter, jitter), seconds=rng.randint(-30, 30))
+
+def generate(out_dir: str, incidents: int = 10000, cameras: int = 50, cameras_per_prefix: int = 4, days: int = 7,
+             duplicate_rate: float = 0.1, question_rate: float = 0.01, citi_only_rate: float = 0.15,
+             sidera_only_rate: float = 0.15, carril_rate: float = 0.3, jitter: int = 1,
+             seed: int = 0) -> Tuple[str, str, str]:
+    """
+    Write a Citi, Sidera and Carriles export triplet of `incidents` incidents.
+    Each one is logged by Citi and/or Sidera (the second with up to
+    `jitter` minutes of difference), sometimes more than once
+    (`duplicate_rate`), sometimes on the '?' camera (`question_rate`), and
+    sometimes has a carril alarm for one of its camera's lanes (`carril_rate`).
+    Returns the three file paths.
+    """
+    rng = random.Random(seed)
+    ids = camera_ids(cameras, cameras_per_prefix)
+    start = datetime(2024, 1, 1)
+    span = days * 24 * 60 * 60
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = tuple(os.path.join(out_dir, name) for name in ("citi.csv", "sidera.csv", "carriles.csv"))
+    files = [open(path, "w", encoding="iso-8859-1", newline="") for path in paths]
+    try:
+        citi, sidera, carriles = (csv.writer(f, delimiter=';') for f in files)
+        citi.writerow(CITI_HEADER)
+        sidera.writerow(SIDERA_HEADER)
+        carriles.writerow(CARRILES_HEADER)
+
+        for _ in range(incidents):
+            moment = start + timedelta(seconds=rng.randrange(span))
+            camera = '?' if rng.random() < question_rate else rng.choice(ids)
+            desc = rng.choice(DESCRIPTIONS)
+            kind = rng.random()
+            logged_by_citi = kind >= sidera_only_rate
+            logged_by_sidera = kind < sidera_only_rate or kind >= sidera_only_rate + citi_only_rate
+
+            copies = 2 if rng.random() < duplicate_rate else 1
+            for _ in range(copies if logged_by_citi else 0):
+                when = jittered(moment, rng, jitter) if copies > 1 else moment
+                citi.writerow([camera, when.strftime("%d/%m/%Y %H:%M:%S"), "Incidente", desc,
+                               when.strftime("%Y"), when.strftime("%H:%M")])
+            for _ in range(copies if logged_by_sidera else 0):
+                when = jittered(moment, rng, jitter)
+                sidera.writerow([camera, desc, when.strftime("%d/%m/%Y %H:%M:%S"),
+                                 when.strftime("%Y"), when.strftime("%H:%M"), when.strftime("%S")])
+            if rng.random() < carril_rate:
+                when = jittered(moment, rng, jitter)
+                lane = camera[:6] + f"L{rng.randint(1, 3)}" if camera != '?' else rng.choice(ids)[:6] + "L1"
+                carriles.writerow([lane, desc, when.strftime("%d/%m/%Y"), when.strftime("%H:%M")])
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate synthetic Citi, Sidera and Carriles exports')
+    parser.add_argument('out_dir', help='Directory for citi.csv, sidera.csv and carriles.csv')
+    parser.add_argument('--incidents', type=int, default=10000, help='Incidents to generate (default: 10000)')
+    parser.add_argument('--cameras', type=int, default=50, help='Number of cameras (default: 50)')
+    parser.add_argument('--cameras-per-prefix', type=int, default=4,
+                        help='Cameras sharing each 6-char prefix, which carriles match on (default: 4)')
+    parser.add_argument('--days', type=int, default=7, help='Days covered by the exports (default: 7)')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1, help='Share of incidents logged twice (default: 0.1)')
+    parser.add_argument('--question-rate', type=float, default=0.01, help="Share of incidents on camera '?' (default: 0.01)")
+    parser.add_argument('--citi-only-rate', type=float, default=0.15, help='Share of incidents only in Citi (default: 0.15)')
+    parser.add_argument('--sidera-only-rate', type=float, default=0.15, help='Share of incidents only in Sidera (default: 0.15)')
+    parser.add_argument('--carril-rate', type=float, default=0.3, help='Share of incidents with a carril alarm (default: 0.3)')
+    parser.add_argument('--jitter', type=int, default=1, help='Max minutes between systems for one incident (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    args = parser.parse_args()
+
+    for path in generate(args.out_dir, args.incidents, args.cameras, args.cameras_per_prefix, args.days,
+                         args.duplicate_rate, args.question_rate, args.citi_only_rate, args.sidera_only_rate,
+                         args.carril_rate, args.jitter, args.seed):
+        print(f"Wrote {path}")
@@ -1,13 +1,39 @@
+import copy
+import cProfile
 import csv
+import gc
+import json
 from enum import Enum
-from typing import List, Tuple, Dict, Set
-from datetime import datetime, timedelta
-from collections import Counter
-import openpyxl
+from typing import List, Tuple, Dict, Set, Optional, Iterable, Iterator, Callable, Union, Sequence, TYPE_CHECKING
+from datetime import datetime
+from collections import Counter, deque
+import heapq
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from itertools import islice, zip_longest
 import time
-from openpyxl.styles import PatternFill, Font
+import hashlib
+import mmap
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+if TYPE_CHECKING:
+    # Only for annotations, openpyxl is imported when a workbook is written (see import_openpyxl)
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
 
 class DebugStats:
+    """
+    Counters of one run: totals, match results, failure reasons, comparisons
+    made and the wall time and rows of each pipeline phase. The code that
+    produces them adds to current_stats(), so concurrent runs each collect
+    into their own instance through collecting().
+    """
     def __init__(self):
         self.total_citi = 0
         self.total_sidera = 0
@@ -15,13 +41,71 @@ class DebugStats:
         self.matches = Counter()
         self.failed_matches = Counter()
         self.carril_matches = Counter()
+        self.parse_errors = Counter()
         self.camera_stats = {
             'citi': Counter(),
             'sidera': Counter(),
             'carriles': Counter(),
             'common': Counter()
         }
-        
+        self.comparisons = Counter()
+        # Clusters of a --state run, the ones big enough to store and how many of those were reused
+        self.incremental = Counter()
+        self.phases: Dict[str, Dict[str, float]] = {}
+        # Calls and cumulative seconds of the hot-path functions, only filled in by --profile
+        self.primitives: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[Dict[str, float]]:
+        """Time a block as part of a phase; add its row count to the yielded record"""
+        record = self.phases.setdefault(name, {'seconds': 0.0, 'rows': 0})
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] += time.perf_counter() - start
+
+    def merge(self, other: 'DebugStats') -> None:
+        """Add the counters of another DebugStats, e.g. from a worker process"""
+        self.total_citi += other.total_citi
+        self.total_sidera += other.total_sidera
+        self.total_carriles += other.total_carriles
+        self.matches.update(other.matches)
+        self.failed_matches.update(other.failed_matches)
+        self.carril_matches.update(other.carril_matches)
+        self.parse_errors.update(other.parse_errors)
+        for source, counter in other.camera_stats.items():
+            self.camera_stats[source].update(counter)
+        self.comparisons.update(other.comparisons)
+        self.incremental.update(other.incremental)
+        for name, record in other.phases.items():
+            mine = self.phases.setdefault(name, {'seconds': 0.0, 'rows': 0})
+            mine['seconds'] += record['seconds']
+            mine['rows'] += record['rows']
+        for name, record in other.primitives.items():
+            mine = self.primitives.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            mine['calls'] += record['calls']
+            mine['seconds'] += record['seconds']
+
+    def to_dict(self) -> Dict:
+        """Plain-data view of the counters, for --metrics and schedulers"""
+        return {
+            'totals': {'citi': self.total_citi, 'sidera': self.total_sidera, 'carriles': self.total_carriles},
+            'phases': {name: dict(record) for name, record in self.phases.items()},
+            'comparisons': dict(self.comparisons),
+            'incremental': dict(self.incremental),
+            'primitives': {name: dict(record) for name, record in self.primitives.items()},
+            'matches': dict(self.matches),
+            'failed_matches': dict(self.failed_matches),
+            'carril_matches': dict(self.carril_matches),
+            'parse_errors': dict(self.parse_errors),
+            'cameras': {source: len(counter) for source, counter in self.camera_stats.items()},
+        }
+
+    def to_json(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
     def print_summary(self):
         print("\n=== ESTADÍSTICAS DE COINCIDENCIA ===")
         print(f"Total registros Citi: {self.total_citi}")
@@ -45,11 +129,45 @@ class DebugStats:
             translated_reason = reason_translations.get(reason, reason)
             print(f"  {translated_reason}: {count}")
         
+        if self.parse_errors:
+            print("\nHoras que no se pudieron procesar:")
+            for source, count in self.parse_errors.items():
+                print(f"  {source}: {count}")
+
         print("\nCoincidencias con carriles:")
         for match_type, count in self.carril_matches.items():
             print(f"  {match_type}: {count}")
 
-debug_stats = DebugStats()
+        if self.incremental:
+            print("\nModo incremental:")
+            print(f"  grupos: {self.incremental['clusters']}, {self.incremental['stored']} de más de dos registros, "
+                  f"{self.incremental['reused']} de ellos reutilizados")
+
+        if self.phases:
+            print("\nTiempos por fase:")
+            for name, record in self.phases.items():
+                print(f"  {name}: {record['seconds']:.2f} s, {record['rows']} filas")
+
+        if self.primitives:
+            print("\nFunciones del camino crítico (tiempo acumulado con el perfilador activo):")
+            for name, record in sorted(self.primitives.items(), key=lambda item: -item[1]['seconds']):
+                print(f"  {name}: {record['calls']} llamadas, {record['seconds']:.2f} s")
+
+# Counters go to the DebugStats of the run in progress; code running outside
+# of collecting() adds to a shared fallback instance
+_current_stats: ContextVar[DebugStats] = ContextVar('current_stats', default=DebugStats())
+
+def current_stats() -> DebugStats:
+    return _current_stats.get()
+
+@contextmanager
+def collecting(stats: DebugStats) -> Iterator[DebugStats]:
+    """Make `stats` the current DebugStats for the duration of the block"""
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
 
 def extract_time(time_str: str) -> str:
     """Extract time in HH:MM format"""
@@ -60,23 +178,47 @@ def extract_time(time_str: str) -> str:
             return f"{parts[0].zfill(2)}:{parts[1].zfill(2)}"
     return time_str
 
-def is_similar_time(time_str1: str, time_str2: str) -> bool:
-    """Compare two time strings with 1-minute tolerance"""
+def parse_minutes(time_str: str) -> int:
+    """Parse a time string into minutes since midnight, raises ValueError"""
+    dt = datetime.strptime(extract_time(time_str), "%H:%M")
+    return dt.hour * 60 + dt.minute
+
+def time_to_minutes(time_str: str) -> Optional[int]:
+    """Convert a time string to minutes since midnight, None if it can't be parsed"""
     try:
-        time1 = extract_time(time_str1)
-        time2 = extract_time(time_str2)
-        
-        dt1 = datetime.strptime(time1, "%H:%M")
-        dt2 = datetime.strptime(time2, "%H:%M")
-        
-        diff = abs(dt1 - dt2)
-        if diff > timedelta(hours=23):
-            diff = timedelta(hours=24) - diff
-        
-        return diff <= timedelta(minutes=1)
-    except ValueError as e:
-        print(f"Error comparing times: '{time_str1}' and '{time_str2}'")
-        raise e
+        return parse_minutes(time_str)
+    except ValueError:
+        return None
+
+def minutes_apart(minute1: int, minute2: int) -> int:
+    """Distance in minutes between two times of day, wrapping around midnight"""
+    diff = abs(minute1 - minute2)
+    if diff > 23 * 60:
+        diff = 24 * 60 - diff
+    return diff
+
+# datetime.min expressed as a sort key (year * 1440 + minute of day)
+SORT_KEY_MIN = 1440
+
+def date_sort_key(dt: datetime) -> int:
+    """Integer sort key ordering the same way as the datetime"""
+    return dt.year * 1440 + dt.hour * 60 + dt.minute
+
+def parse_sort_key(year: str, hour: str, minute: Optional[int]) -> Optional[int]:
+    """
+    Sort key for a log's year and hour, as extract_date_for_sorting would compute it:
+    None if either is blank, SORT_KEY_MIN if they don't parse as "%Y %H:%M".
+    `minute` is the already parsed hour, only valid here for plain "H:M" strings.
+    """
+    if not year or not hour:
+        return None
+    parts = hour.split(':')
+    if minute is None or len(parts) != 2 or not parts[0] or not parts[1]:
+        return SORT_KEY_MIN
+    try:
+        return datetime.strptime(year, "%Y").year * 1440 + minute
+    except ValueError:
+        return SORT_KEY_MIN
 
 def clean_camera_id(s: str) -> str:
     """Clean camera ID"""
@@ -91,30 +233,54 @@ EMPTY_CITI = ["","","","","",""]
 EMPTY_SIDERA = ["","","","","",""]
 EMPTY_CARRIL = ["","","",""]
 
+# Columns whose values repeat across rows (camera, description, year,
+# hour...). Their cells are interned so all the rows, and the fields
+# parsed from them, share one string per value.
+CITI_SHARED_COLUMNS = (0, 2, 3, 4, 5)
+SIDERA_SHARED_COLUMNS = (0, 1, 3, 4, 5)
+CARRIL_SHARED_COLUMNS = (0, 1, 2, 3)
+
+def intern_cells(line: List[str], columns: Tuple[int, ...]) -> None:
+    for column in columns:
+        if column < len(line):
+            line[column] = sys.intern(line[column])
+
 class MatchState(Enum):
     IDENTICAL = 1
     SIMILAR = 2
     DIFFERENT = 3
 
 class Log:
+    # No per-instance __dict__, there are millions of these on big exports
+    __slots__ = ('is_citi', 'raw', 'camera_id', 'desc', 'year', 'hour', 'seconds', 'minute', 'sort_key')
+
     def __init__(self, line: List, is_citi: bool):
         try:
             self.is_citi = is_citi
+            intern_cells(line, CITI_SHARED_COLUMNS if is_citi else SIDERA_SHARED_COLUMNS)
             self.raw = line
-            self.camera_id = clean_camera_id(line[0])
+            self.camera_id = sys.intern(clean_camera_id(line[0]))
             
+            stats = current_stats()
             stats_key = 'citi' if is_citi else 'sidera'
-            debug_stats.camera_stats[stats_key][self.camera_id] += 1
+            stats.camera_stats[stats_key][self.camera_id] += 1
             
             if is_citi:
-                self.desc = clean_description(line[3])
-                self.year = line[4].strip()
-                self.hour = line[5].strip()
+                self.desc = sys.intern(clean_description(line[3]))
+                self.year = sys.intern(line[4].strip())
+                self.hour = sys.intern(line[5].strip())
+                self.seconds = None
             else:
-                self.desc = clean_description(line[1])
-                self.year = line[3].strip()
-                self.hour = line[4].strip()
+                self.desc = sys.intern(clean_description(line[1]))
+                self.year = sys.intern(line[3].strip())
+                self.hour = sys.intern(line[4].strip())
                 self.seconds = line[5].strip() if len(line) > 5 else ""
+
+            # Parse the hour once, comparisons only use the minute of day
+            self.minute = time_to_minutes(self.hour)
+            if self.minute is None:
+                stats.parse_errors[stats_key] += 1
+            self.sort_key = parse_sort_key(self.year, self.hour, self.minute)
         except IndexError as e:
             print(f"Error processing line: {line}")
             raise e
@@ -128,92 +294,71 @@ class Log:
             print(f"Self:  {self.camera_id} | {self.desc} | {self.year} | {self.hour}")
             print(f"Other: {other.camera_id} | {other.desc} | {other.year} | {other.hour}")
 
+        stats = current_stats()
+        stats.comparisons['logs'] += 1
+
         # If either camera is "?", they can't match
         if self.camera_id == '?' or other.camera_id == '?':
-            debug_stats.failed_matches['question_mark_camera'] += 1
+            stats.failed_matches['question_mark_camera'] += 1
             return MatchState.DIFFERENT
 
         if self.camera_id != other.camera_id:
-            debug_stats.failed_matches['camera_mismatch'] += 1
+            stats.failed_matches['camera_mismatch'] += 1
             return MatchState.DIFFERENT
 
         if self.year != other.year:
-            debug_stats.failed_matches['year_mismatch'] += 1
+            stats.failed_matches['year_mismatch'] += 1
             return MatchState.DIFFERENT
 
         if self.desc != other.desc:
-            debug_stats.failed_matches['description_mismatch'] += 1
+            stats.failed_matches['description_mismatch'] += 1
             return MatchState.DIFFERENT
 
-        try:
-            if self.hour == other.hour:
-                return MatchState.IDENTICAL
+        if self.hour == other.hour:
+            return MatchState.IDENTICAL
 
-            if is_similar_time(self.hour, other.hour):
-                return MatchState.SIMILAR
-            
-            debug_stats.failed_matches['time_mismatch'] += 1
-        except ValueError:
-            debug_stats.failed_matches['time_parse_error'] += 1
+        if self.minute is None or other.minute is None:
+            stats.failed_matches['time_parse_error'] += 1
             if debug:
                 print(f"Time comparison failed for {self} and {other}")
             return MatchState.DIFFERENT
-            
+
+        if minutes_apart(self.minute, other.minute) <= 1:
+            return MatchState.SIMILAR
+
+        stats.failed_matches['time_mismatch'] += 1
         return MatchState.DIFFERENT
 
 class CarrilLog:
+    __slots__ = ('raw', 'camera_prefix', 'full_id', 'desc', 'date', 'hour', 'minute')
+
     def __init__(self, line: List):
+        intern_cells(line, CARRIL_SHARED_COLUMNS)
         self.raw = line
-        self.camera_prefix = line[0][:6]  # First 6 chars of Equipo
+        self.camera_prefix = sys.intern(line[0][:6])  # First 6 chars of Equipo
         self.full_id = line[0]
-        self.desc = clean_description(line[1])
+        self.desc = sys.intern(clean_description(line[1]))
         self.date = line[2]
-        self.hour = line[3].strip()
+        self.hour = sys.intern(line[3].strip())
+        self.minute = time_to_minutes(self.hour)
         
         # Update carril statistics
-        debug_stats.camera_stats['carriles'][self.camera_prefix] += 1
-
-    def matches_camera(self, camera_id: str) -> bool:
-        """Check if this carril matches a camera ID"""
-        return self.camera_prefix == camera_id[:6]
-
-    def matches_time(self, other_hour: str) -> bool:
-        """Check if time matches within tolerance"""
-        try:
-            return is_similar_time(self.hour, other_hour)  # Uses existing 1-minute tolerance
-        except ValueError:
-            return False
-
-    def matches_event(self, log: Log) -> bool:
-        """
-        Check if this carril matches a log entry.
-        Matches if:
-        1. Camera prefix matches
-        2. Description is exactly the same
-        3. Time is within 1 minute (using existing tolerance)
-        """
-        # First check the 6-char prefix match
-        if not self.matches_camera(log.camera_id):
-            return False
-            
-        # Check description matching
-        if self.desc != log.desc:
-            return False
-            
-        # Then check time match with 1-minute tolerance
-        if not self.matches_time(log.hour):
-            return False
-            
-        return True
+        stats = current_stats()
+        stats.camera_stats['carriles'][self.camera_prefix] += 1
+        if self.minute is None:
+            stats.parse_errors['carriles'] += 1
 
     def __str__(self):
         return f"{self.full_id}_{self.date}_{self.hour}"
 
 class TrafficEvent:
+    __slots__ = ('citi_logs', 'sidera_logs', 'carril_logs')
+
     def __init__(self, log: Log = None):
         self.citi_logs: List[Log] = []
         self.sidera_logs: List[Log] = []
-        self.carril_logs: List[CarrilLog] = []
+        # Most events have no carril: they share an empty tuple until add_carril()
+        self.carril_logs: Sequence[CarrilLog] = ()
         if log is not None:
             if log.is_citi:
                 self.citi_logs.append(log)
@@ -237,40 +382,11 @@ class TrafficEvent:
                 return True
         return False
 
-    def try_add_carril(self, carril: CarrilLog, used_carriles: Set[CarrilLog]) -> bool:
-        """Try to add a carril log if it matches this event"""
-        if carril in used_carriles or carril in self.carril_logs:
-            return False
-            
-        matched = False 
-        
-        for citi_log in self.citi_logs:
-            if carril.matches_event(citi_log):
-                self.carril_logs.append(carril)
-                debug_stats.carril_matches['matched_citi'] += 1
-                matched = True
-                break  # Stop after first match
-                
-        # If not matched with Citi, try Sidera logs
-        if not matched:
-            for sidera_log in self.sidera_logs:
-                if carril.matches_event(sidera_log):
-                    self.carril_logs.append(carril)
-                    debug_stats.carril_matches['matched_sidera'] += 1
-                    matched = True
-                    break  # Stop after first match
-
-        # For "no coincide" cases
-        if not matched and not self.has_match() and (self.citi_logs or self.sidera_logs):
-            source_logs = self.citi_logs if self.citi_logs else self.sidera_logs
-            for log in source_logs:
-                if carril.matches_event(log):
-                    self.carril_logs.append(carril)
-                    debug_stats.carril_matches['matched_no_coincide'] += 1
-                    matched = True
-                    break  # Stop after first match
-
-        return matched
+    def add_carril(self, carril: CarrilLog) -> None:
+        if self.carril_logs:
+            self.carril_logs.append(carril)
+        else:
+            self.carril_logs = [carril]
 
     def has_match(self) -> bool:
         """Check if this event has matching Citi and Sidera logs"""
@@ -292,7 +408,7 @@ class TrafficEvent:
 
     def title(self) -> str:
         status = self._calculate_title()
-        debug_stats.matches[status] += 1
+        current_stats().matches[status] += 1
         return status
     
     def _calculate_title(self) -> str:
@@ -330,6 +446,26 @@ class TrafficEvent:
                 len(self.carril_logs) > 0)
 
     def return_list(self) -> List:
+        return [row for _, row in self.keyed_rows()]
+
+    def row_sort_key(self, i: int, row: List) -> int:
+        """
+        Sort key of output row i, the same order extract_date_for_sorting gives
+        but reusing the keys each log computed when it was parsed.
+        """
+        citi_log = self.citi_logs[i] if i < len(self.citi_logs) else None
+        sidera_log = self.sidera_logs[i] if i < len(self.sidera_logs) else None
+        if citi_log is not None and len(citi_log.raw) != len(EMPTY_CITI):
+            # Extra Citi columns shift the Sidera ones, so go by the row itself
+            return date_sort_key(extract_date_for_sorting(row))
+        if citi_log is not None and citi_log.sort_key is not None:
+            return citi_log.sort_key
+        if sidera_log is not None and sidera_log.sort_key is not None:
+            return sidera_log.sort_key
+        return SORT_KEY_MIN
+
+    def keyed_rows(self) -> List[Tuple[int, List]]:
+        """Output rows of this event, each paired with its sort key"""
         if not self.has_content():
             return []  # Return empty list if no actual content
             
@@ -360,10 +496,592 @@ class TrafficEvent:
 
             # Only add rows that have at least some content
             if any(cell for cell in citi_row + sidera_row + carril_row):
-                return_list.append(citi_row + sidera_row + carril_row + [row_title, self.carril_state()])
+                row = citi_row + sidera_row + carril_row + [row_title, self.carril_state()]
+                return_list.append((self.row_sort_key(i, row), row))
 
         return return_list
 
+class CarrilIndex:
+    """
+    Index of events keyed by (6-char camera prefix, description, minute of day).
+    A carril only needs to look at the buckets of its own minute and the
+    minutes right before and after it (wrapping around midnight), the same
+    1-minute tolerance Log.compare uses.
+    """
+    def __init__(self, events: List[TrafficEvent]):
+        self.buckets: Dict[Tuple[str, str, int], List[Tuple[int, bool]]] = {}
+        for event_idx, event in enumerate(events):
+            for log in event.citi_logs + event.sidera_logs:
+                if log.minute is None:
+                    continue  # Unparseable hours never match a carril
+                key = (log.camera_id[:6], log.desc, log.minute)
+                self.buckets.setdefault(key, []).append((event_idx, log.is_citi))
+
+    def find(self, carril: CarrilLog) -> Tuple[Optional[int], bool]:
+        """
+        Return the index of the first event matching the carril and whether
+        the match was made through one of its Citi logs.
+        """
+        current_stats().comparisons['carril_lookups'] += 1
+        if carril.minute is None:
+            return None, False
+
+        candidates = []
+        for delta in (-1, 0, 1):
+            key = (carril.camera_prefix, carril.desc, (carril.minute + delta) % 1440)
+            bucket = self.buckets.get(key)
+            if bucket:
+                candidates.append(bucket)
+        if not candidates:
+            return None, False
+
+        # Buckets are filled in event order, so the first entry is the lowest index
+        best_idx = min(bucket[0][0] for bucket in candidates)
+        matched_citi = False
+        for bucket in candidates:
+            for event_idx, is_citi in bucket:
+                if event_idx != best_idx:
+                    break
+                matched_citi = matched_citi or is_citi
+        return best_idx, matched_citi
+
+def attach_carriles(events: List[TrafficEvent], carril_logs: List[CarrilLog], debug: bool = False) -> Set[CarrilLog]:
+    """
+    Attach every carril to the first event with a log of the same camera
+    prefix and description within a minute of it, found through a
+    CarrilIndex instead of scanning every event for every carril.
+    """
+    index = CarrilIndex(events)
+    used_carriles = set()
+    stats = current_stats()
+
+    for carril_log in carril_logs:
+        event_idx, matched_citi = index.find(carril_log)
+        if event_idx is None:
+            if debug:
+                stats.carril_matches['unmatched'] += 1
+            continue
+        events[event_idx].add_carril(carril_log)
+        used_carriles.add(carril_log)
+        stats.carril_matches['matched_citi' if matched_citi else 'matched_sidera'] += 1
+
+    return used_carriles
+
+class ColumnWidths:
+    """
+    Column widths tracked while rows are produced, so no second pass over
+    the sheet is needed. A column is as wide as its longest str(value) plus 2;
+    cells missing from short rows count as 'None', like the empty cells
+    openpyxl reports for them. With sample_every > 1 only one row out of
+    every sample_every is measured (the first one always is), and max_width
+    caps the final widths.
+    """
+    def __init__(self, max_width: Optional[int] = None, sample_every: int = 1):
+        self.max_width = max_width
+        self.sample_every = max(1, sample_every)
+        self.max_lengths: List[int] = []
+        self.shortest_row: Optional[int] = None
+        self.rows_seen = 0
+
+    @classmethod
+    def tracker(cls, track: bool, max_width: Optional[int] = None, sample_every: int = 1) -> Optional['ColumnWidths']:
+        """A new ColumnWidths, or None when widths aren't tracked"""
+        return cls(max_width, sample_every) if track else None
+
+    @staticmethod
+    def widths_of(tracker: Optional['ColumnWidths']) -> List[int]:
+        """The widths a tracker measured, none without a tracker"""
+        return tracker.widths() if tracker is not None else []
+
+    def add(self, row: List) -> None:
+        self.rows_seen += 1
+        if (self.rows_seen - 1) % self.sample_every:
+            return
+
+        lengths = [len(str(value)) for value in row]
+        known = len(self.max_lengths)
+        common = min(len(lengths), known)
+        self.max_lengths[:common] = map(max, self.max_lengths[:common], lengths[:common])
+        if len(lengths) > known:
+            self.max_lengths.extend(lengths[known:])
+        if self.shortest_row is None or len(lengths) < self.shortest_row:
+            self.shortest_row = len(lengths)
+
+    def add_rows(self, rows: List[List]) -> None:
+        """Same as add() on each row, measuring a whole block column by column"""
+        sampled = rows[-self.rows_seen % self.sample_every::self.sample_every]
+        self.rows_seen += len(rows)
+        if not sampled:
+            return
+
+        # Cells missing from short rows count as '' here, and as 'None' in widths()
+        lengths = [max(map(len, map(str, column))) for column in zip_longest(*sampled, fillvalue='')]
+        known = len(self.max_lengths)
+        common = min(len(lengths), known)
+        self.max_lengths[:common] = map(max, self.max_lengths[:common], lengths[:common])
+        if len(lengths) > known:
+            self.max_lengths.extend(lengths[known:])
+        shortest = min(map(len, sampled))
+        if self.shortest_row is None or shortest < self.shortest_row:
+            self.shortest_row = shortest
+
+    def merge(self, other: 'ColumnWidths') -> None:
+        """
+        Take in the rows another ColumnWidths measured, as if they came after
+        this one's. Only exact when neither samples: which rows are sampled
+        depends on where they fall in the whole export.
+        """
+        known = len(self.max_lengths)
+        common = min(len(other.max_lengths), known)
+        self.max_lengths[:common] = map(max, self.max_lengths[:common], other.max_lengths[:common])
+        if len(other.max_lengths) > known:
+            self.max_lengths.extend(other.max_lengths[known:])
+        if other.shortest_row is not None and (self.shortest_row is None or other.shortest_row < self.shortest_row):
+            self.shortest_row = other.shortest_row
+        self.rows_seen += other.rows_seen
+
+    def widths(self) -> List[int]:
+        if not self.max_lengths:
+            return []
+        widths = []
+        for col, length in enumerate(self.max_lengths):
+            if col >= self.shortest_row:
+                length = max(length, len('None'))
+            width = length + 2
+            if self.max_width is not None:
+                width = min(width, self.max_width)
+            widths.append(width)
+        return widths
+
+def read_rows(path: str) -> Iterator[List[str]]:
+    """Yield the rows of a ;-separated iso-8859-1 export as they are read"""
+    with open(path, encoding='iso-8859-1') as raw:
+        yield from csv.reader(raw, delimiter=';')
+
+# An export is read from a file path or taken as already-split rows
+ExportSource = Union[str, os.PathLike, Iterable[List[str]]]
+
+READ_CHUNK_ROWS = 10_000
+READ_BLOCK_BYTES = 1 << 20
+# What splitting on bytes can't handle like csv.reader: quoting, NULs and lone \r line ends
+NEEDS_CSV_READER = re.compile(rb'["\x00]|\r(?!\n)')
+
+def line_bounds(data: mmap.mmap, block_bytes: int) -> Iterator[Tuple[int, int]]:
+    """(start, end) byte offsets of blocks of about block_bytes, each ending on a line end"""
+    size = len(data)
+    start = 0
+    while start < size:
+        end = data.find(b'\n', start + block_bytes)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+def split_lines(data: bytes) -> List[List[str]]:
+    """Rows of whole lines cut from an export that doesn't need csv.reader"""
+    lines = data.replace(b'\r\n', b'\n').decode('iso-8859-1').split('\n')
+    if lines[-1] == '':
+        lines.pop()  # Nothing after the block's last line end
+    return [line.split(';') if line else [] for line in lines]
+
+def read_blocks(path: str) -> Iterator[List[List[str]]]:
+    """
+    Yield the rows of an export in blocks of about READ_BLOCK_BYTES. The
+    file is memory-mapped and cut on line ends as bytes, and each block is
+    decoded in one go and split on ';'. Files that need real CSV parsing
+    (quoted fields) go through csv.reader, READ_CHUNK_ROWS rows at a time.
+    Either way the rows are the ones csv.reader returns.
+    """
+    with open(path, 'rb') as raw:
+        size = os.fstat(raw.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if NEEDS_CSV_READER.search(data) is None:
+                for start, end in line_bounds(data, READ_BLOCK_BYTES):
+                    yield split_lines(data[start:end])
+                return
+
+    rows = read_rows(path)
+    while True:
+        block = list(islice(rows, READ_CHUNK_ROWS))
+        if not block:
+            return
+        yield block
+
+def parse_logs(rows: Iterable[List[str]], is_citi: bool) -> Iterator[Log]:
+    """Turn Citi or Sidera rows into Log records"""
+    for line in rows:
+        yield Log(line, is_citi)
+
+def parse_carriles(rows: Iterable[List[str]]) -> Iterator[CarrilLog]:
+    """Turn Carriles rows into CarrilLog records"""
+    for line in rows:
+        yield CarrilLog(line)
+
+def source_blocks(source: ExportSource) -> Iterator[List[List[str]]]:
+    """Blocks of rows from an export path, or READ_CHUNK_ROWS at a time from an iterable of rows"""
+    if isinstance(source, (str, os.PathLike)):
+        yield from read_blocks(source)
+        return
+    rows = iter(source)
+    while True:
+        block = [list(row) for row in islice(rows, READ_CHUNK_ROWS)]
+        if not block:
+            return
+        yield block
+
+@contextmanager
+def gc_paused() -> Iterator[None]:
+    """
+    Keep the cyclic garbage collector off while a block makes many
+    long-lived objects and no cycles: every collection it would trigger
+    walks all the records made so far and frees nothing.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def load_export(source: ExportSource, parse: Callable[[Iterable[List[str]]], Iterator], widths: Optional[ColumnWidths] = None) -> Tuple[Optional[List[str]], List]:
+    """
+    Stream an export into records without keeping the file as a list of rows.
+    `source` is a file path or an iterable of rows, header first. Returns
+    the header row (None for an empty export) and the parsed records;
+    each record keeps a reference to its row in `raw`. Rows are measured
+    into `widths` as they are read, and read and parsed a block at a time
+    so the two are timed as separate phases.
+    """
+    header = None
+    records = []
+    with gc_paused():
+        for header, block_records in parsed_blocks(source, parse, widths):
+            records.extend(block_records)
+    return header, records
+
+def parsed_blocks(source: ExportSource, parse: Callable[[Iterable[List[str]]], Iterator],
+                  widths: Optional[ColumnWidths] = None) -> Iterator[Tuple[List[str], List]]:
+    """
+    The header and the records of each block of an export, read, measured
+    and timed as load_export does, for callers that store the records
+    somewhere else instead of keeping them all.
+    """
+    stats = current_stats()
+    blocks = source_blocks(source)
+    header = None
+    while True:
+        with stats.phase('read') as read:
+            block = next(blocks, None)
+            if block is None:
+                return
+            if widths is not None:
+                widths.add_rows(block)
+            if header is None:
+                header, block = block[0], block[1:]
+            read['rows'] += len(block)
+        with stats.phase('parse') as parsed:
+            records = list(parse(block))
+            parsed['rows'] += len(block)
+        yield header, records
+
+class ExportCache:
+    """
+    Parsed exports kept in memory between reconciliations, for long-running
+    callers such as watch.py. An entry is reused while its file keeps the
+    same size and modification time; the counters its parsing added are
+    replayed into the current DebugStats, without the read and parse time.
+    """
+    def __init__(self):
+        self.entries: Dict[tuple, tuple] = {}
+        self.lock = threading.Lock()
+
+    def load(self, path: str, kind: str, parse: Callable[[Iterable[List[str]]], Iterator],
+             widths: Optional[ColumnWidths] = None) -> Tuple[Optional[List[str]], List]:
+        """load_export through the cache; `kind` tells apart the ways a path is parsed"""
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        key = (os.path.abspath(path), kind, None if widths is None else (widths.max_width, widths.sample_every))
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is not None and entry[0] == signature:
+            _, header, records, cached_widths, counters = entry
+            if widths is not None:
+                widths.__dict__.update(copy.deepcopy(cached_widths.__dict__))
+            current_stats().merge(counters)
+            return header, records
+
+        parsed = DebugStats()
+        with collecting(parsed):
+            header, records = load_export(path, parse, widths)
+        current_stats().merge(parsed)
+        parsed.phases = {}
+        with self.lock:
+            self.entries[key] = (signature, header, records, copy.deepcopy(widths), parsed)
+        return header, records
+
+    def prune(self, paths: Iterable[str]) -> None:
+        """Forget the exports of every path not in `paths`"""
+        keep = {os.path.abspath(path) for path in paths}
+        with self.lock:
+            for key in [key for key in self.entries if key[0] not in keep]:
+                del self.entries[key]
+
+# Record class of each kind of export, to rebuild records stored by DiskCache
+RECORD_CLASSES = {'citi': Log, 'sidera': Log, 'carriles': CarrilLog}
+
+# How each kind of export is parsed, looked up by name in the parse workers
+EXPORT_PARSERS = {
+    'citi': lambda rows: parse_logs(rows, True),
+    'sidera': lambda rows: parse_logs(rows, False),
+    'carriles': parse_carriles,
+}
+
+class DiskCache:
+    """
+    Content-addressed cache on local disk of parsed exports and of the events
+    matched from them. Entries are pickles of plain data (slot value tuples,
+    lists and counters, never this module's classes, so the cache works
+    whether lol.py runs as a script or is imported) named after a SHA-256 of
+    everything they depend on: the input files' contents and the matching
+    parameters. Reading an entry refreshes its mtime, and the least recently
+    used entries are removed once the directory grows past max_bytes.
+    """
+    # Bumped whenever the slots of the cached records or counters change
+    SCHEMA_VERSION = 4
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.digests: Dict[tuple, str] = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def file_digest(self, path: str) -> str:
+        """SHA-256 of a file's content, hashed once per size and mtime"""
+        stat = os.stat(path)
+        memo = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        if memo not in self.digests:
+            with open(path, 'rb') as f:
+                self.digests[memo] = hashlib.file_digest(f, 'sha256').hexdigest()
+        return self.digests[memo]
+
+    def key(self, *parts) -> str:
+        return hashlib.sha256(json.dumps([self.SCHEMA_VERSION, *parts]).encode()).hexdigest()
+
+    def get(self, key: str):
+        path = os.path.join(self.directory, key + ".pickle")
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            # A truncated or outdated entry is a miss
+            os.remove(path)
+            return None
+        os.utime(path)
+        return value
+
+    def put(self, key: str, value) -> None:
+        path = os.path.join(self.directory, key + ".pickle")
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        with self.lock:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".pickle")]
+            stats = [(entry.stat(), entry.path) for entry in entries]
+            total = sum(stat.st_size for stat, _ in stats)
+            for stat, path in sorted(stats, key=lambda entry: entry[0].st_mtime_ns):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= stat.st_size
+
+    @staticmethod
+    def record_state(record) -> tuple:
+        """A record's slot values, None for the ones it never set"""
+        return tuple(getattr(record, name, None) for name in type(record).__slots__)
+
+    @staticmethod
+    def record_from(record_class, state: tuple):
+        record = record_class.__new__(record_class)
+        for name, value in zip(record_class.__slots__, state):
+            setattr(record, name, value)
+        return record
+
+    @staticmethod
+    def stats_state(stats: DebugStats) -> dict:
+        """A DebugStats' counters as plain data, the rows of its phases but not their timings"""
+        state = dict(vars(stats))
+        state['phases'] = {name: {'seconds': 0.0, 'rows': record['rows']} for name, record in stats.phases.items()}
+        return state
+
+    @staticmethod
+    def stats_from(state: dict) -> DebugStats:
+        stats = DebugStats()
+        stats.__dict__.update(state)
+        return stats
+
+    def load(self, path: str, kind: str, parse: Callable[[Iterable[List[str]]], Iterator],
+             widths: Optional[ColumnWidths] = None) -> Tuple[Optional[List[str]], List]:
+        """load_export through the cache, with the same interface as ExportCache.load"""
+        with current_stats().phase('read'):
+            key = self.key('export', self.file_digest(path), kind,
+                           None if widths is None else [widths.max_width, widths.sample_every])
+            stored = self.get(key)
+            if stored is not None:
+                header, states, widths_state, counters = stored
+                record_class = RECORD_CLASSES[kind]
+                records = [self.record_from(record_class, state) for state in states]
+                if widths is not None:
+                    widths.__dict__.update(widths_state)
+        # Row counts included, the same counters as parsing the file again
+        if stored is not None:
+            current_stats().merge(self.stats_from(counters))
+            return header, records
+
+        parsed = DebugStats()
+        with collecting(parsed):
+            header, records = load_export(path, parse, widths)
+        current_stats().merge(parsed)
+        self.put(key, (header, [self.record_state(record) for record in records],
+                       None if widths is None else vars(widths), self.stats_state(parsed)))
+        return header, records
+
+# Bytes of an export parsed by one task of load_exports
+PARSE_CHUNK_BYTES = 4 << 20
+
+def export_chunks(path: Union[str, os.PathLike]) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    Line-aligned (start, end) byte ranges of an export for the parse
+    workers, or a single (None, None) for the whole file when it needs
+    csv.reader, which can't start halfway through a quoted field.
+    """
+    with open(path, 'rb') as raw:
+        if os.fstat(raw.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if NEEDS_CSV_READER.search(data) is not None:
+                return [(None, None)]
+            return list(line_bounds(data, PARSE_CHUNK_BYTES))
+
+def parse_export_chunk(task: Tuple[str, str, Optional[int], Optional[int], bool]) -> Tuple[Optional[List[str]], List[tuple], Optional[ColumnWidths], DebugStats]:
+    """
+    Read and parse one chunk of an export in a worker process. Records come
+    back as their slot values (cheaper to send than the objects), with the
+    header if the chunk starts the file, the chunk's column widths when
+    asked to measure them and the counters parsing added.
+    """
+    path, kind, start, end, measure = task
+    # Counters of this chunk only, as in match_partition
+    with collecting(DebugStats()) as stats, gc_paused():
+        if start is None:
+            rows = list(read_rows(path))
+        else:
+            with open(path, 'rb') as raw, mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                rows = split_lines(data[start:end])
+        widths = None
+        if measure:
+            widths = ColumnWidths()
+            widths.add_rows(rows)
+        header = rows.pop(0) if not start and rows else None
+        states = [DiskCache.record_state(record) for record in EXPORT_PARSERS[kind](rows)]
+    stats.phases = {}
+    return header, states, widths, stats
+
+def load_exports(sources: List[Tuple[ExportSource, str, Optional[ColumnWidths]]], workers: int) -> List[Tuple[Optional[List[str]], List]]:
+    """
+    load_export of several (source, kind, widths) exports at once, on a
+    process pool. Every file is cut into chunks of about PARSE_CHUNK_BYTES,
+    so the three exports are parsed side by side and a big one keeps all
+    the workers busy. Chunks are put back in file order, so records come
+    out in the same order, with the same widths and counters, as loading
+    the exports one after another. Exports given as rows are loaded here
+    while the workers parse the files. Widths of a sampled ColumnWidths
+    are measured here, since sampling depends on where a row falls.
+    """
+    stats = current_stats()
+    results: List[Optional[Tuple[Optional[List[str]], List]]] = [None] * len(sources)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        with stats.phase('read'):
+            for position, (source, kind, widths) in enumerate(sources):
+                if isinstance(source, (str, os.PathLike)):
+                    measure = widths is not None and widths.sample_every == 1
+                    futures[position] = [pool.submit(parse_export_chunk, (source, kind, start, end, measure))
+                                         for start, end in export_chunks(source)]
+
+        for position, (source, kind, widths) in enumerate(sources):
+            if position not in futures:
+                results[position] = load_export(source, EXPORT_PARSERS[kind], widths)
+
+        for position, chunks in futures.items():
+            _, kind, widths = sources[position]
+            record_class = RECORD_CLASSES[kind]
+            header = None
+            records = []
+            with stats.phase('parse') as parsed, gc_paused():
+                for chunk in chunks:
+                    chunk_header, states, chunk_widths, chunk_stats = chunk.result()
+                    if chunk_header is not None:
+                        header = chunk_header
+                    records.extend(DiskCache.record_from(record_class, state) for state in states)
+                    if chunk_widths is not None:
+                        widths.merge(chunk_widths)
+                    stats.merge(chunk_stats)
+                parsed['rows'] += len(records)
+            with stats.phase('read') as read:
+                if widths is not None and widths.sample_every > 1 and header is not None:
+                    widths.add_rows([header])
+                    for start in range(0, len(records), READ_CHUNK_ROWS):
+                        widths.add_rows([record.raw for record in records[start:start + READ_CHUNK_ROWS]])
+                read['rows'] += len(records)
+            results[position] = (header, records)
+    return results
+
+class ExportFile:
+    """
+    The data rows of an export file, read again from disk each time it is
+    iterated. Raw source sheets are written from it in a second pass over
+    the file, without going through the parsed records.
+    """
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = path
+
+    def __iter__(self) -> Iterator[List[str]]:
+        blocks = read_blocks(self.path)
+        first = next(blocks, None)
+        if first is None:
+            return
+        yield from first[1:]  # The header is written on its own
+        for block in blocks:
+            yield from block
+
+def raw_rows(header: Optional[List[str]], records: Iterable) -> Iterator[List[str]]:
+    """Rows of an export, from its header and the records' raw rows or an ExportFile"""
+    if header is not None:
+        yield header
+    if isinstance(records, ExportFile):
+        yield from records
+        return
+    for record in records:
+        yield record.raw
+
+def source_records(source: ExportSource, records: Iterable) -> Iterable:
+    """What a raw source sheet is written from: the file again for a path, else the records"""
+    return ExportFile(source) if isinstance(source, (str, os.PathLike)) else records
+
 def extract_date_for_sorting(event_row: List) -> datetime:
     try:
         citi_year = event_row[4].strip()
@@ -380,11 +1098,423 @@ def extract_date_for_sorting(event_row: List) -> datetime:
     except (ValueError, IndexError):
         return datetime.min
 
-def process_citi_sidera_logs(citi_logs: List[Log], sidera_logs: List[Log], debug: bool = False) -> Tuple[List[TrafficEvent], Set[CarrilLog]]:
+class TimeWindowBuckets:
+    """
+    Logs of one camera group bucketed by (year, description, minute of day).
+    Two logs compare as not DIFFERENT exactly when one sits in a bucket of the
+    other's window: its own minute and the minutes right before and after it,
+    wrapping around midnight. Logs whose hour can't be parsed only match the
+    exact same hour string, so they get a bucket keyed by that string.
+    Each bucket keeps its logs in input order, so the front of a bucket is
+    always the first unused log, which is what the greedy pairing picks.
+    """
+    def __init__(self, group: List[Tuple[int, Log]]):
+        self.logs = [log for _, log in group]
+        self.used = [False] * len(group)
+        self.buckets: Dict[tuple, deque] = {}
+        for position, log in enumerate(self.logs):
+            self.buckets.setdefault(self.own_key(log), deque()).append(position)
+
+    @staticmethod
+    def own_key(log: Log) -> tuple:
+        if log.minute is None:
+            return (log.year, log.desc, log.hour)
+        return (log.year, log.desc, log.minute)
+
+    @staticmethod
+    def window_keys(log: Log) -> List[tuple]:
+        if log.minute is None:
+            return [(log.year, log.desc, log.hour)]
+        return [(log.year, log.desc, (log.minute + delta) % 1440) for delta in (-1, 0, 1)]
+
+    def _front(self, key: tuple) -> Optional[int]:
+        bucket = self.buckets.get(key)
+        while bucket and self.used[bucket[0]]:
+            bucket.popleft()
+        return bucket[0] if bucket else None
+
+    def take_first(self, keys: List[tuple]) -> Optional[Log]:
+        """Mark as used and return the first unused log in the window"""
+        fronts = [position for position in map(self._front, keys) if position is not None]
+        if not fronts:
+            return None
+        position = min(fronts)
+        self.used[position] = True
+        return self.logs[position]
+
+    def take_all(self, keys: List[tuple]) -> List[Log]:
+        """Mark as used and return every unused log in the window, in input order"""
+        positions = []
+        for key in keys:
+            bucket = self.buckets.pop(key, None)
+            if bucket:
+                positions.extend(position for position in bucket if not self.used[position])
+        positions.sort()
+        for position in positions:
+            self.used[position] = True
+        return [self.logs[position] for position in positions]
+
+def pair_camera_sweep(citi_group: List[Tuple[int, Log]], sidera_group: List[Tuple[int, Log]]) -> List[TrafficEvent]:
+    """
+    Same greedy pairing as pair_camera_legacy, but each log only looks at the
+    buckets inside its 1-minute window instead of scanning the whole group.
+    """
+    events = []
+    citi_buckets = TimeWindowBuckets(citi_group)
+    sidera_buckets = TimeWindowBuckets(sidera_group)
+
+    for position, citi_log in enumerate(citi_buckets.logs):
+        if citi_buckets.used[position]:
+            continue
+        citi_buckets.used[position] = True
+        event = TrafficEvent(citi_log)
+        keys = TimeWindowBuckets.window_keys(citi_log)
+
+        # First matching Sidera log in input order
+        sidera_log = sidera_buckets.take_first(keys)
+        if sidera_log is not None:
+            event.sidera_logs.append(sidera_log)
+
+        # Every other Citi log similar to this one
+        event.citi_logs.extend(citi_buckets.take_all(keys))
+        events.append(event)
+
+    # Remaining unmatched Sidera logs, grouped with their similar Sidera logs
+    for position, sidera_log in enumerate(sidera_buckets.logs):
+        if sidera_buckets.used[position]:
+            continue
+        sidera_buckets.used[position] = True
+        event = TrafficEvent(sidera_log)
+        event.sidera_logs.extend(sidera_buckets.take_all(TimeWindowBuckets.window_keys(sidera_log)))
+        events.append(event)
+
+    return events
+
+def pair_camera_legacy(citi_group: List[Tuple[int, Log]], sidera_group: List[Tuple[int, Log]]) -> List[TrafficEvent]:
+    """Original pairing: every citi log against every sidera and citi log of the camera"""
     events = []
     used_sidera = set()
     used_citi = set()
 
+    # Try to find matches between Citi and Sidera first
+    for citi_idx, citi_log in citi_group:
+        if citi_idx in used_citi:
+            continue
+
+        best_match = None
+        best_match_idx = None
+        event = TrafficEvent(citi_log)
+        used_citi.add(citi_idx)
+
+        # Look for matching Sidera log
+        for sidera_idx, sidera_log in sidera_group:
+            if sidera_idx not in used_sidera:
+                match_state = citi_log.compare(sidera_log)
+                if match_state != MatchState.DIFFERENT:
+                    best_match = sidera_log
+                    best_match_idx = sidera_idx
+                    break  # Found a match, no need to continue searching
+
+        # If found a match, add it to the event
+        if best_match is not None:
+            event.add_if_same(best_match)
+            used_sidera.add(best_match_idx)
+
+        # Look for similar Citi logs
+        for other_citi_idx, other_citi_log in citi_group:
+            if other_citi_idx != citi_idx and other_citi_idx not in used_citi:
+                if citi_log.compare(other_citi_log) != MatchState.DIFFERENT:
+                    event.add_if_same(other_citi_log)
+                    used_citi.add(other_citi_idx)
+
+        events.append(event)
+
+    # Handle remaining unmatched Sidera logs for this camera
+    for sidera_idx, sidera_log in sidera_group:
+        if sidera_idx not in used_sidera:
+            event = TrafficEvent(sidera_log)
+            used_sidera.add(sidera_idx)
+
+            # Look for similar Sidera logs
+            for other_sidera_idx, other_sidera_log in sidera_group:
+                if other_sidera_idx != sidera_idx and other_sidera_idx not in used_sidera:
+                    if sidera_log.compare(other_sidera_log) != MatchState.DIFFERENT:
+                        event.add_if_same(other_sidera_log)
+                        used_sidera.add(other_sidera_idx)
+
+            events.append(event)
+
+    return events
+
+def assignment_path(citi_counts: List[int], sidera_counts: List[int], first_in: int = 0, last_out: int = 0) -> Optional[Tuple[int, List[int]]]:
+    """
+    Best Citi/Sidera assignment over consecutive minutes, minute i holding
+    citi_counts[i] Citi and sidera_counts[i] Sidera logs. A log pairs with
+    one of its own minute (no difference) or of the minute next to it (one
+    minute). Two pairs never cross the same boundary in opposite directions,
+    as swapping them would remove both differences, so the flow across the
+    boundary after minute i fits in one signed number: y > 0 Citi logs of
+    minute i pair with Sidera logs of minute i + 1, y < 0 the other way
+    round. A dynamic program over those numbers finds the most pairs, and
+    among those the smallest total difference, in time linear in the
+    minutes (times the squared burst size). first_in and last_out fix the
+    flow coming into the first minute and leaving the last, for a cycle of
+    minutes cut open at one boundary. Returns the score and the flow after each minute, or
+    None when the fixed flows can't be met.
+    """
+    # One more pair always beats any saving in time difference
+    pair_score = sum(citi_counts) + sum(sidera_counts) + 1
+    minutes = len(citi_counts)
+    # best[y] = (score, previous flow) for the flow y leaving the current minute
+    best: Dict[int, Tuple[int, Optional[int]]] = {first_in: (0, None)}
+    choices: List[Dict[int, Tuple[int, Optional[int]]]] = []
+    for i in range(minutes):
+        citi, sidera = citi_counts[i], sidera_counts[i]
+        if i == minutes - 1:
+            outgoing = [last_out]
+        else:
+            outgoing = range(-min(sidera, citi_counts[i + 1]), min(citi, sidera_counts[i + 1]) + 1)
+        step: Dict[int, Tuple[int, Optional[int]]] = {}
+        for x, (score, _) in best.items():
+            for y in outgoing:
+                citi_left = citi - max(-x, 0) - max(y, 0)
+                sidera_left = sidera - max(x, 0) - max(-y, 0)
+                if citi_left < 0 or sidera_left < 0:
+                    continue
+                total = score + min(citi_left, sidera_left) * pair_score + abs(y) * (pair_score - 1)
+                if y not in step or total > step[y][0]:
+                    step[y] = (total, x)
+        choices.append(step)
+        best = step
+    if last_out not in best:
+        return None
+
+    flows = [last_out]
+    for step in reversed(choices[1:]):
+        flows.append(step[flows[-1]][1])
+    flows.reverse()
+    return best[last_out][0], flows
+
+def optimal_pairs(citi_logs: List[Log], sidera_logs: List[Log]) -> List[Tuple[Log, Log]]:
+    """
+    Citi/Sidera pairs of one (camera, year, description) component with the
+    most pairs and, among those, the smallest total time difference. Logs
+    of the same minute are paired in input order. Unparseable hours only
+    pair with the same hour string.
+    """
+    pairs = []
+    citi_by_slot: Dict[object, List[Log]] = {}
+    sidera_by_slot: Dict[object, List[Log]] = {}
+    for log in citi_logs:
+        citi_by_slot.setdefault(log.minute if log.minute is not None else log.hour, []).append(log)
+    for log in sidera_logs:
+        sidera_by_slot.setdefault(log.minute if log.minute is not None else log.hour, []).append(log)
+
+    for slot, citi in citi_by_slot.items():
+        if not isinstance(slot, int):
+            pairs.extend(zip(citi, sidera_by_slot.get(slot, [])))
+
+    # Runs of occupied minutes, the only places where pairs can chain
+    occupied = sorted(slot for slot in set(citi_by_slot) | set(sidera_by_slot) if isinstance(slot, int))
+    if not occupied:
+        return pairs
+    if len(occupied) == 1440:
+        runs, wraps = [occupied], True
+    else:
+        # Start right after a free minute so no run is cut at midnight
+        start = next(i for i, minute in enumerate(occupied) if (minute - 1) % 1440 != occupied[i - 1])
+        occupied = occupied[start:] + occupied[:start]
+        runs, wraps = [[occupied[0]]], False
+        for minute in occupied[1:]:
+            if minute == (runs[-1][-1] + 1) % 1440:
+                runs[-1].append(minute)
+            else:
+                runs.append([minute])
+
+    for run in runs:
+        citi_counts = [len(citi_by_slot.get(minute, [])) for minute in run]
+        sidera_counts = [len(sidera_by_slot.get(minute, [])) for minute in run]
+        if wraps:
+            # Every minute of the day is taken, so the minutes form a cycle.
+            # Cut it at the boundary with the fewest possible flows across it
+            # and try each of them as the flow into the first minute and out
+            # of the last one
+            def flow_range(i: int) -> Tuple[int, int]:
+                following = (i + 1) % len(run)
+                return -min(sidera_counts[i], citi_counts[following]), min(citi_counts[i], sidera_counts[following])
+            cut = min(range(len(run)), key=lambda i: flow_range(i)[1] - flow_range(i)[0])
+            lowest, highest = flow_range(cut)
+            first = cut + 1
+            run = run[first:] + run[:first]
+            citi_counts = citi_counts[first:] + citi_counts[:first]
+            sidera_counts = sidera_counts[first:] + sidera_counts[:first]
+            # Every flow in the range can be met (the other boundaries can
+            # carry none), and the best score is concave in it: it is a min
+            # cost flow's cost as a function of the flow fixed on one edge.
+            # So binary search for the lowest flow where the score stops rising
+            solutions: Dict[int, Tuple[int, List[int]]] = {}
+            def solve(flow: int) -> int:
+                if flow not in solutions:
+                    solutions[flow] = assignment_path(citi_counts, sidera_counts, flow, flow)
+                return solutions[flow][0]
+            while lowest < highest:
+                middle = (lowest + highest) // 2
+                if solve(middle + 1) > solve(middle):
+                    lowest = middle + 1
+                else:
+                    highest = middle
+            solve(lowest)
+            _, flows = solutions[lowest]
+            incoming = [flows[-1]] + flows[:-1]
+        else:
+            _, flows = assignment_path(citi_counts, sidera_counts)
+            incoming = [0] + flows[:-1]
+
+        # Hand out each minute's logs in input order: to the previous minute,
+        # to their own minute, then to the next minute
+        to_next: List[Log] = []
+        for minute, x, y in zip(run, incoming, flows):
+            citi = citi_by_slot.get(minute, [])
+            sidera = sidera_by_slot.get(minute, [])
+            citi_to_previous, sidera_to_previous = max(-x, 0), max(x, 0)
+            if x > 0:
+                pairs.extend(zip(to_next, sidera[:x]))
+            if wraps and minute == run[0]:
+                first_citi, first_sidera = citi[:citi_to_previous], sidera[:sidera_to_previous]
+            elif x < 0:
+                pairs.extend(zip(citi[:citi_to_previous], to_next))
+            citi = citi[citi_to_previous:]
+            sidera = sidera[sidera_to_previous:]
+            same = min(len(citi) - max(y, 0), len(sidera) - max(-y, 0))
+            pairs.extend(zip(citi[:same], sidera[:same]))
+            to_next = citi[same:same + y] if y > 0 else sidera[same:same - y]
+        if wraps:
+            # The last minute's flow goes to the first one
+            if flows[-1] > 0:
+                pairs.extend(zip(to_next, first_sidera))
+            elif flows[-1] < 0:
+                pairs.extend(zip(first_citi, to_next))
+    return pairs
+
+def pair_camera_optimal(citi_group: List[Tuple[int, Log]], sidera_group: List[Tuple[int, Log]]) -> List[TrafficEvent]:
+    """
+    Citi/Sidera pairs chosen by optimal_pairs in each (year, description)
+    component instead of greedily, so in a burst a Sidera log doesn't go to
+    the first Citi log that fits when that leaves another one unpaired or
+    further apart. Each pair is an event. A Citi log left unpaired joins the
+    event of a paired Citi log in its window, the way
+    the greedy matchers group similar Citi logs: an event of its own minute
+    if there is one, else of the minutes next to it, the one with the
+    earliest Citi log on ties. The rest of the unpaired logs are grouped as
+    in pair_camera_sweep. Events keep the sweep order:
+    Citi-started ones in Citi order, then Sidera-only ones in Sidera order.
+    """
+    citi_index = {id(log): idx for idx, log in citi_group}
+    sidera_index = {id(log): idx for idx, log in sidera_group}
+    components: Dict[Tuple[str, str], Tuple[List[Log], List[Log]]] = {}
+    for _, log in citi_group:
+        components.setdefault((log.year, log.desc), ([], []))[0].append(log)
+    for _, log in sidera_group:
+        components.setdefault((log.year, log.desc), ([], []))[1].append(log)
+
+    def anchor_index(event: TrafficEvent) -> int:
+        return citi_index[id(event.citi_logs[0])]
+
+    citi_events: List[TrafficEvent] = []
+    unpaired_citi: List[Tuple[int, Log]] = []
+    unpaired_sidera: List[Tuple[int, Log]] = []
+    for citi_part, sidera_part in components.values():
+        pairs = optimal_pairs(citi_part, sidera_part)
+        paired = {id(log) for pair in pairs for log in pair}
+        paired_by_key: Dict[tuple, List[TrafficEvent]] = {}
+        for citi_log, sidera_log in pairs:
+            event = TrafficEvent(citi_log)
+            event.sidera_logs.append(sidera_log)
+            citi_events.append(event)
+            paired_by_key.setdefault(TimeWindowBuckets.own_key(citi_log), []).append(event)
+
+        for log in citi_part:
+            if id(log) in paired:
+                continue
+            candidates = paired_by_key.get(TimeWindowBuckets.own_key(log)) or [
+                event for key in TimeWindowBuckets.window_keys(log) for event in paired_by_key.get(key, [])]
+            if candidates:
+                min(candidates, key=anchor_index).citi_logs.append(log)
+            else:
+                unpaired_citi.append((citi_index[id(log)], log))
+        unpaired_sidera.extend((sidera_index[id(log)], log) for log in sidera_part if id(log) not in paired)
+
+    for event in citi_events:
+        event.citi_logs[1:] = sorted(event.citi_logs[1:], key=lambda log: citi_index[id(log)])
+
+    # Unpaired logs with their similar unpaired logs, as pair_camera_sweep groups them
+    sidera_events = []
+    for group, events in ((unpaired_citi, citi_events), (unpaired_sidera, sidera_events)):
+        buckets = TimeWindowBuckets(sorted(group, key=lambda entry: entry[0]))
+        for position, log in enumerate(buckets.logs):
+            if buckets.used[position]:
+                continue
+            buckets.used[position] = True
+            event = TrafficEvent(log)
+            (event.citi_logs if log.is_citi else event.sidera_logs).extend(buckets.take_all(TimeWindowBuckets.window_keys(log)))
+            events.append(event)
+
+    citi_events.sort(key=anchor_index)
+    sidera_events.sort(key=lambda event: sidera_index[id(event.sidera_logs[0])])
+    return citi_events + sidera_events
+
+# Pairing strategies selectable with --matcher
+MATCHERS = {
+    'sweep': pair_camera_sweep,
+    'legacy': pair_camera_legacy,
+    'optimal': pair_camera_optimal,
+}
+
+def component_keys(camera_id: str, year: str, desc: str) -> Tuple[tuple, tuple, tuple]:
+    """The camera, (camera, year) and (camera, year, description) keys of a log, for unpaired_reason"""
+    return (camera_id,), (camera_id, year), (camera_id, year, desc)
+
+def unpaired_reason(log: Log, other_keys: Set[tuple]) -> str:
+    """
+    Why a log was left without a log of the other system: the first check
+    of Log.compare that every other-system log of its camera fails, or
+    the time checks when some share its (camera, year, description).
+    other_keys holds the other system's component_keys.
+    """
+    if log.camera_id == '?':
+        return 'question_mark_camera'
+    camera_key, year_key, component_key = component_keys(log.camera_id, log.year, log.desc)
+    if camera_key not in other_keys:
+        return 'camera_mismatch'
+    if year_key not in other_keys:
+        return 'year_mismatch'
+    if component_key not in other_keys:
+        return 'description_mismatch'
+    return 'time_parse_error' if log.minute is None else 'time_mismatch'
+
+def count_unpaired(events: List[TrafficEvent]) -> None:
+    """
+    failed_matches for the matchers that never call Log.compare on logs
+    that don't match: one reason (see unpaired_reason) per Citi log left
+    without a Sidera log and per Sidera log left without a Citi log. The
+    legacy matcher counts every failed comparison instead, so its numbers
+    are much larger.
+    """
+    keys: Dict[bool, Set[tuple]] = {True: set(), False: set()}
+    for event in events:
+        for log in event.citi_logs + event.sidera_logs:
+            keys[log.is_citi].update(component_keys(log.camera_id, log.year, log.desc))
+    failed_matches = current_stats().failed_matches
+    for event in events:
+        if event.citi_logs and event.sidera_logs:
+            continue
+        for log in event.citi_logs or event.sidera_logs:
+            failed_matches[unpaired_reason(log, keys[not log.is_citi])] += 1
+
+def pair_by_camera(citi_logs: List[Log], sidera_logs: List[Log], matcher: str = "sweep") -> Dict[str, List[TrafficEvent]]:
+    """Events of each camera ID, with cameras in order of first appearance"""
+    pair_camera = MATCHERS[matcher]
+
     # Group logs by camera ID
     citi_by_camera: Dict[str, List[Tuple[int, Log]]] = {}
     sidera_by_camera: Dict[str, List[Tuple[int, Log]]] = {}
@@ -400,255 +1530,1144 @@ def process_citi_sidera_logs(citi_logs: List[Log], sidera_logs: List[Log], debug
             sidera_by_camera[log.camera_id] = []
         sidera_by_camera[log.camera_id].append((idx, log))
 
-    # Process each camera ID
-    for camera_id in set(citi_by_camera.keys()) | set(sidera_by_camera.keys()):
+    # Process each camera ID in order of first appearance, so that events
+    # (and the carril that goes to the first matching one) don't depend on
+    # string hashing
+    events_by_camera: Dict[str, List[TrafficEvent]] = {}
+    for camera_id in dict.fromkeys(list(citi_by_camera) + list(sidera_by_camera)):
         if camera_id == '?':
-            # Handle ? cameras separately
-            for citi_idx, citi_log in citi_by_camera.get(camera_id, []):
-                if citi_idx not in used_citi:
-                    event = TrafficEvent(citi_log)
-                    used_citi.add(citi_idx)
-                    events.append(event)
-            
-            for sidera_idx, sidera_log in sidera_by_camera.get(camera_id, []):
-                if sidera_idx not in used_sidera:
-                    event = TrafficEvent(sidera_log)
-                    used_sidera.add(sidera_idx)
-                    events.append(event)
+            # Handle ? cameras separately, they never match anything
+            events = [TrafficEvent(citi_log) for _, citi_log in citi_by_camera.get(camera_id, [])]
+            events.extend(TrafficEvent(sidera_log) for _, sidera_log in sidera_by_camera.get(camera_id, []))
+            events_by_camera[camera_id] = events
             continue
 
         citi_group = citi_by_camera.get(camera_id, [])
         sidera_group = sidera_by_camera.get(camera_id, [])
+        events_by_camera[camera_id] = pair_camera(citi_group, sidera_group)
 
-        # Try to find matches between Citi and Sidera first
-        for citi_idx, citi_log in citi_group:
-            if citi_idx in used_citi:
-                continue
-
-            best_match = None
-            best_match_idx = None
-            event = TrafficEvent(citi_log)
-            used_citi.add(citi_idx)
-
-            # Look for matching Sidera log
-            for sidera_idx, sidera_log in sidera_group:
-                if sidera_idx not in used_sidera:
-                    match_state = citi_log.compare(sidera_log)
-                    if match_state != MatchState.DIFFERENT:
-                        best_match = sidera_log
-                        best_match_idx = sidera_idx
-                        break  # Found a match, no need to continue searching
-
-            # If found a match, add it to the event
-            if best_match is not None:
-                event.add_if_same(best_match)
-                used_sidera.add(best_match_idx)
-
-            # Look for similar Citi logs
-            for other_citi_idx, other_citi_log in citi_group:
-                if other_citi_idx != citi_idx and other_citi_idx not in used_citi:
-                    if citi_log.compare(other_citi_log) != MatchState.DIFFERENT:
-                        event.add_if_same(other_citi_log)
-                        used_citi.add(other_citi_idx)
-
-            events.append(event)
-
-        # Handle remaining unmatched Sidera logs for this camera
-        for sidera_idx, sidera_log in sidera_group:
-            if sidera_idx not in used_sidera:
-                event = TrafficEvent(sidera_log)
-                used_sidera.add(sidera_idx)
-
-                # Look for similar Sidera logs
-                for other_sidera_idx, other_sidera_log in sidera_group:
-                    if other_sidera_idx != sidera_idx and other_sidera_idx not in used_sidera:
-                        if sidera_log.compare(other_sidera_log) != MatchState.DIFFERENT:
-                            event.add_if_same(other_sidera_log)
-                            used_sidera.add(other_sidera_idx)
-
-                events.append(event)
+    return events_by_camera
 
+def process_citi_sidera_logs(citi_logs: List[Log], sidera_logs: List[Log], debug: bool = False, matcher: str = "sweep") -> List[TrafficEvent]:
+    events = []
+    for camera_events in pair_by_camera(citi_logs, sidera_logs, matcher).values():
+        events.extend(camera_events)
     return events
+
+def event_positions(events: List[TrafficEvent], citi_logs: List[Log], sidera_logs: List[Log], carril_logs: List[CarrilLog]) -> List[Tuple[List[int], List[int], List[int]]]:
+    """Events as positions into the citi, sidera and carril lists"""
+    citi_positions = {id(log): position for position, log in enumerate(citi_logs)}
+    sidera_positions = {id(log): position for position, log in enumerate(sidera_logs)}
+    carril_positions = {id(log): position for position, log in enumerate(carril_logs)}
+    return [([citi_positions[id(log)] for log in event.citi_logs],
+             [sidera_positions[id(log)] for log in event.sidera_logs],
+             [carril_positions[id(log)] for log in event.carril_logs])
+            for event in events]
+
+def events_from_positions(positions: List[Tuple[List[int], List[int], List[int]]], citi_logs: List[Log],
+                          sidera_logs: List[Log], carril_logs: List[CarrilLog]) -> List[TrafficEvent]:
+    """Events rebuilt from event_positions"""
+    events = []
+    for citi_positions, sidera_positions, carril_positions in positions:
+        event = TrafficEvent(None)
+        event.citi_logs.extend(citi_logs[position] for position in citi_positions)
+        event.sidera_logs.extend(sidera_logs[position] for position in sidera_positions)
+        for position in carril_positions:
+            event.add_carril(carril_logs[position])
+        events.append(event)
+    return events
+
+def match_partition(task: Tuple[List[Log], List[Log], List[CarrilLog], str, bool]) -> Tuple[List[Tuple[str, int]], List[Tuple[List[int], List[int], List[int]]], List[int], DebugStats]:
+    """
+    Pair the logs of one camera prefix and attach its carriles, in a worker
+    process. Events come back as event_positions into the task's lists, one
+    camera after another with each camera's event count, together with the
+    unmatched carril positions and the counters this partition added.
+    """
+    citi_part, sidera_part, carril_part, matcher, debug = task
+
+    # Forked workers inherit the parent's context, so collect this task's
+    # counters apart: they go back with the result and the parent merges them
+    with collecting(DebugStats()) as stats:
+        events_by_camera = pair_by_camera(citi_part, sidera_part, matcher)
+        events = [event for camera_events in events_by_camera.values() for event in camera_events]
+        used_carriles = attach_carriles(events, carril_part, debug)
+
+    camera_counts = [(camera_id, len(camera_events)) for camera_id, camera_events in events_by_camera.items()]
+    unmatched = [position for position, carril in enumerate(carril_part) if carril not in used_carriles]
+    return camera_counts, event_positions(events, citi_part, sidera_part, carril_part), unmatched, stats
+
+def match_parallel(citi_logs: List[Log], sidera_logs: List[Log], carril_logs: List[CarrilLog], matcher: str = "sweep", workers: int = 2, debug: bool = False) -> Tuple[List[TrafficEvent], Set[CarrilLog]]:
+    """
+    Same events as process_citi_sidera_logs + attach_carriles, computed on a
+    process pool. Logs are partitioned by 6-char camera prefix, which keeps
+    every camera and every carril that could match it in the same partition.
+    Events are put back in the order of their cameras' first appearance, so
+    the output doesn't depend on which worker finishes first.
+    """
+    stats = current_stats()
+    partitions: Dict[str, Tuple[List[Log], List[Log], List[CarrilLog]]] = {}
+    for log in citi_logs:
+        partitions.setdefault(log.camera_id[:6], ([], [], []))[0].append(log)
+    for log in sidera_logs:
+        partitions.setdefault(log.camera_id[:6], ([], [], []))[1].append(log)
+    for carril in carril_logs:
+        if carril.camera_prefix in partitions:
+            partitions[carril.camera_prefix][2].append(carril)
+        elif debug:
+            stats.carril_matches['unmatched'] += 1
+
+    tasks = [(citi_part, sidera_part, carril_part, matcher, debug) for citi_part, sidera_part, carril_part in partitions.values()]
+    chunksize = max(1, len(tasks) // (workers * 4))
+    events_by_camera: Dict[str, List[TrafficEvent]] = {}
+    used_carriles = set()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(match_partition, tasks, chunksize=chunksize)
+        for (citi_part, sidera_part, carril_part), (camera_counts, positions, unmatched, partition_stats) in zip(partitions.values(), results):
+            stats.merge(partition_stats)
+            events = iter(events_from_positions(positions, citi_part, sidera_part, carril_part))
+            for camera_id, count in camera_counts:
+                events_by_camera[camera_id] = list(islice(events, count))
+            unmatched = set(unmatched)
+            used_carriles.update(carril for position, carril in enumerate(carril_part) if position not in unmatched)
+
+    camera_order = dict.fromkeys([log.camera_id for log in citi_logs] + [log.camera_id for log in sidera_logs])
+    events = [event for camera_id in camera_order for event in events_by_camera[camera_id]]
+    return events, used_carriles
 
-def compare_files(citi_path: str, sidera_path: str, carriles_path: str, debug: bool = False, output_path: str = "output.xlsx"):
-    start_time = time.time()
-
-def compare_files(citi_path: str, sidera_path: str, carriles_path: str, debug: bool = False, output_path: str = "output.xlsx"):
-    print("Iniciando comparación...")
-    start_time = time.time()
-    debug_stats.__init__()
-    
+class IncrementalState:
+    """
+    SQLite file remembering, between runs, the events paired for each
+    cluster of logs (see minute_clusters) of more than two logs, keyed by a
+    hash of the cluster's rows. Pairing never looks across clusters, so a
+    cluster's events only change when its own rows do, and a rolling window
+    pairs again only the clusters that the days it adds or drops reach.
+    """
+    SCHEMA_VERSION = 3
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        # Files of older versions kept whole components
+        self.connection.execute("DROP TABLE IF EXISTS components")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS clusters (
+                fingerprint TEXT PRIMARY KEY,
+                events TEXT NOT NULL
+            )""")
+
+    def load(self) -> Dict[str, str]:
+        """Stored events of every cluster by fingerprint, still as JSON"""
+        return dict(self.connection.execute("SELECT fingerprint, events FROM clusters"))
+
+    def update(self, added: Dict[str, list], removed: Iterable[str]) -> None:
+        """Store the events of the clusters paired this run and forget the ones no longer in the inputs"""
+        self.connection.executemany("DELETE FROM clusters WHERE fingerprint = ?", [(key,) for key in removed])
+        self.connection.executemany("INSERT OR REPLACE INTO clusters (fingerprint, events) VALUES (?, ?)",
+                                    [(key, json.dumps(events)) for key, events in added.items()])
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+def minute_clusters(logs: List[Log]) -> List[List[int]]:
+    """
+    Positions in `logs` of the clusters that pair independently of each other,
+    in input order: in each (camera, year, description) component, runs of
+    minutes holding logs, the last run joining the first when both minutes
+    around midnight hold logs. Logs with an unparseable hour make a cluster
+    per hour string, and '?' logs one each since they never match anything.
+    """
+    n = len(logs)
+    clusters: List[List[int]] = []
+    # Parseable logs as minute * n + position, so they sort by minute
+    components: Dict[Tuple[str, str, str], List[int]] = {}
+    unparsed: Dict[Tuple[str, str, str, str], List[int]] = {}
+    for position, log in enumerate(logs):
+        if log.camera_id == '?':
+            clusters.append([position])
+        elif log.minute is None:
+            unparsed.setdefault((log.camera_id, log.year, log.desc, log.hour), []).append(position)
+        else:
+            components.setdefault((log.camera_id, log.year, log.desc), []).append(log.minute * n + position)
+    clusters.extend(unparsed.values())
+
+    for keys in components.values():
+        keys.sort()
+        runs: List[List[int]] = []
+        previous = -2
+        for key in keys:
+            minute, position = divmod(key, n)
+            if minute - previous > 1:
+                runs.append([])
+            runs[-1].append(position)
+            previous = minute
+        # Minute 1439 sits right before minute 0
+        if len(runs) > 1 and keys[0] < n and keys[-1] >= 1439 * n:
+            runs[0].extend(runs.pop())
+        for run in runs:
+            run.sort()
+        clusters.extend(runs)
+    return clusters
+
+def cluster_fingerprint(matcher: str, logs: List[Log]) -> str:
+    """Hash of everything a cluster's events depend on"""
+    rows = "\x1e".join("\x1f".join(log.raw) for log in logs)
+    return hashlib.sha1(f"{IncrementalState.SCHEMA_VERSION}\x1d{matcher}\x1d{rows}".encode()).hexdigest()
+
+def match_incremental(citi_logs: List[Log], sidera_logs: List[Log], carril_logs: List[CarrilLog], state: IncrementalState, matcher: str = "sweep", debug: bool = False) -> Tuple[List[TrafficEvent], Set[CarrilLog]]:
+    """
+    Same events as process_citi_sidera_logs + attach_carriles, pairing again
+    only the clusters whose rows changed since the run that filled `state`
+    and reusing the stored events of the others. Clusters of one or two
+    logs, nearly all of them, are one event whatever the matcher, so only
+    larger ones are stored. Carriles are attached on every run, through the
+    CarrilIndex that is cheap to rebuild. Not for the legacy matcher, which
+    counts failed comparisons across clusters.
+    """
+    logs = citi_logs + sidera_logs
+    n = len(logs)
+    stats = current_stats()
+    # Events with the position of the log that starts them
+    anchored: List[Tuple[int, TrafficEvent]] = []
+
+    def add_event(positions: List[int]) -> None:
+        event = TrafficEvent(None)
+        for position in positions:
+            log = logs[position]
+            (event.citi_logs if log.is_citi else event.sidera_logs).append(log)
+        anchored.append((positions[0], event))
+
+    stored = state.load()
+    reused: Dict[str, List[int]] = {}
+    changed: Dict[str, List[int]] = {}
+    clusters = minute_clusters(logs)
+    for cluster in clusters:
+        if len(cluster) <= 2:
+            # The first log starts the event and takes the other, which is
+            # a similar log of its system or the matching one of the other
+            event = TrafficEvent(logs[cluster[0]])
+            if len(cluster) == 2:
+                log = logs[cluster[1]]
+                (event.citi_logs if log.is_citi else event.sidera_logs).append(log)
+            anchored.append((cluster[0], event))
+            continue
+        fingerprint = cluster_fingerprint(matcher, [logs[position] for position in cluster])
+        (reused if fingerprint in stored else changed)[fingerprint] = cluster
+    stats.incremental.update(clusters=len(clusters), stored=len(reused) + len(changed), reused=len(reused))
+
+    # Stored events are lists of positions in their cluster, decoded in one go
+    for cluster, cluster_events in zip(reused.values(), json.loads("[" + ",".join(map(stored.get, reused)) + "]")):
+        for members in cluster_events:
+            add_event([cluster[position] for position in members])
+
+    # Clusters pair independently, so the changed ones pair in a single call
+    paired: Dict[str, list] = {fingerprint: [] for fingerprint in changed}
+    where = {id(logs[position]): (fingerprint, position, member)
+             for fingerprint, cluster in changed.items() for member, position in enumerate(cluster)}
+    changed_positions = sorted(position for cluster in changed.values() for position in cluster)
+    for event in process_citi_sidera_logs([logs[position] for position in changed_positions if position < len(citi_logs)],
+                                          [logs[position] for position in changed_positions if position >= len(citi_logs)],
+                                          debug, matcher):
+        places = [where[id(log)] for log in event.citi_logs + event.sidera_logs]
+        paired[places[0][0]].append([member for _, _, member in places])
+        anchored.append((places[0][1], event))
+    state.update(paired, stored.keys() - reused.keys())
+
+    # Put events back in the order a full run builds them: by camera, then
+    # Citi-started events in Citi order before Sidera-only events in Sidera
+    # order, which is position order
+    camera_rank = {camera_id: rank for rank, camera_id in enumerate(dict.fromkeys(log.camera_id for log in logs))}
+    anchored.sort(key=lambda item: camera_rank[logs[item[0]].camera_id] * n + item[0])
+    events = [event for _, event in anchored]
+
+    used_carriles = attach_carriles(events, carril_logs, debug)
+    return events, used_carriles
+
+# Fill color of each status, with black text for all
+STATUS_COLORS = {
+    'coincide': '00FF00',  # Green
+    'NO COINCIDE CITILOG': 'FF0000',  # Red, fixed case to match the status string
+    'coincide diff horas': '0000FF',  # Blue
+    'NO COINCIDE SIDERA': 'FF0000',  # Red, fixed case to match the status string
+    'repetido citi': 'FFFF00',  # Yellow
+    'repetido sidera': 'FFFF00',  # Yellow
+    'repetido ambos': 'FFFF00',  # Yellow
+}
+
+def import_openpyxl():
+    """openpyxl, imported the first time a workbook is written: it takes a while and only XLSX output needs it"""
     try:
-        # Read input files
-        with open(citi_path, encoding='iso-8859-1') as citi_raw:
-            citi_log_file = list(csv.reader(citi_raw, delimiter=';'))
-        
-        with open(sidera_path, encoding='iso-8859-1') as sidera_raw:
-            sidera_log_file = list(csv.reader(sidera_raw, delimiter=';'))
-            
-        with open(carriles_path, encoding='iso-8859-1') as carriles_raw:
-            carriles_log_file = list(csv.reader(carriles_raw, delimiter=';'))
-
-        # Create Excel workbook
-        workbook = openpyxl.Workbook()
-        
-        # Create comparison sheet (first sheet)
+        import openpyxl
+    except ImportError as e:
+        raise ImportError("XLSX output needs openpyxl (pip install openpyxl)") from e
+    return openpyxl
+
+# Headers of the comparison sheet
+COMPARISON_HEADERS = [
+    # Citi headers
+    "CITILOG CameraName", "CITILOG Start", "CITILOG IncType", 
+    "CITILOG IncType", "CITILOG TEXTO AÑOS", "CITILOG TEXTO HORAS",
+    # Sidera headers
+    "SIDERA Equipo", "SIDERA Desc. variable", "SIDERA Fecha", 
+    "SIDERA TEXTO AÑOS", "SIDERA TEXTO HORAS", "SIDERA TEXTO SEGUNDOS",
+    # Carril headers
+    "CARRIL Equipo", "CARRIL Desc. variable", "CARRIL Fecha", "CARRIL Hora",
+    # Status columns
+    "ESTADO", "ESTADO CARRIL"
+]
+
+def register_status_styles(workbook: 'openpyxl.Workbook') -> None:
+    """Register one named style per status so cells only reference it by name"""
+    from openpyxl.styles import PatternFill, Font, NamedStyle
+    for status, color in STATUS_COLORS.items():
+        fill = PatternFill(start_color=color, end_color=color, fill_type='solid')
+        workbook.add_named_style(NamedStyle(name=status, fill=fill, font=Font(color='000000')))
+
+def set_column_widths(sheet, widths: List[int]) -> None:
+    from openpyxl.utils import get_column_letter
+    for col, width in enumerate(widths, start=1):
+        sheet.column_dimensions[get_column_letter(col)].width = width
+
+# Rows of an Excel sheet, header included
+EXCEL_MAX_ROWS = 1_048_576
+
+def sheet_rows(value: str) -> int:
+    """argparse type of --max-sheet-rows, which has to be at least 2 like write_xlsx wants"""
+    import argparse
+    rows = int(value)
+    if rows < 2:
+        raise argparse.ArgumentTypeError("has to leave room for the header and one row, at least 2")
+    return rows
+
+def write_xlsx(output_path: str, rows: Iterable[List], widths: List[int], sources: List[Tuple[str, Optional[List[str]], Iterable, List[int]]],
+               write_only: bool = False, max_sheet_rows: int = EXCEL_MAX_ROWS) -> None:
+    """
+    Write the comparison rows and the raw source sheets to an Excel workbook.
+    `widths` are the comparison sheet's column widths and `sources` holds
+    (sheet title, header row, records or ExportFile, column widths) for
+    each input export. A source with more than `max_sheet_rows` rows
+    (header included) goes on to "<title> (2)" and so on, each sheet with
+    the header again. With write_only, openpyxl streams each row to disk
+    as it is appended instead of building the whole workbook in memory.
+    """
+    if max_sheet_rows < 2:
+        raise ValueError("max_sheet_rows has to leave room for the header and one row")
+    openpyxl = import_openpyxl()
+    from openpyxl.cell import WriteOnlyCell
+    workbook = openpyxl.Workbook(write_only=write_only)
+    register_status_styles(workbook)
+
+    # Create comparison sheet (first sheet)
+    if write_only:
+        comparison_sheet = workbook.create_sheet("Comparación")
+    else:
         comparison_sheet = workbook.active
         comparison_sheet.title = "Comparación"
+    # Write-only sheets need their widths before the first row
+    set_column_widths(comparison_sheet, widths)
+    comparison_sheet.append(COMPARISON_HEADERS)
+
+    if write_only:
+        # One styled cell per status, reused for every value of its rows
+        status_cells = {status: WriteOnlyCell(comparison_sheet) for status in STATUS_COLORS}
+        for status, cell in status_cells.items():
+            cell.style = status
+
+    # Add rows to sheet with formatting
+    for row_idx, row in enumerate(rows, start=2):  # start=2 because row 1 is headers
+        # Get the status (second to last column)
+        status = row[-2]
+
+        if write_only:
+            if status in STATUS_COLORS:
+                row = styled_values(status_cells[status], row)
+            comparison_sheet.append(row)
+            continue
 
-        # Define styles
-        from openpyxl.styles import PatternFill, Font
-
-        # Color definitions with black text for all
-        styles = {
-            'coincide': {
-                'fill': PatternFill(start_color='00FF00', end_color='00FF00', fill_type='solid'),  # Green
-                'font': Font(color='000000')
-            },
-            'NO COINCIDE CITILOG': {  # Fixed case to match the status string
-                'fill': PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid'),  # Red
-                'font': Font(color='000000')
-            },
-            'coincide diff horas': {
-                'fill': PatternFill(start_color='0000FF', end_color='0000FF', fill_type='solid'),  # Blue
-                'font': Font(color='000000')
-            },
-            'NO COINCIDE SIDERA': {  # Fixed case to match the status string
-                'fill': PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid'),  # Red
-                'font': Font(color='000000')
-            },
-            'repetido citi': {
-                'fill': PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid'),  # Yellow
-                'font': Font(color='000000')
-            },
-            'repetido sidera': {
-                'fill': PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid'),  # Yellow
-                'font': Font(color='000000')
-            },
-            'repetido ambos': {
-                'fill': PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid'),  # Yellow
-                'font': Font(color='000000')
-            }
-}
-        # Rest of the code remains the same...
-
-        # Add headers to comparison sheet
-        headers = [
-            # Citi headers
-            "CITILOG CameraName", "CITILOG Start", "CITILOG IncType", 
-            "CITILOG IncType", "CITILOG TEXTO AÑOS", "CITILOG TEXTO HORAS",
-            # Sidera headers
-            "SIDERA Equipo", "SIDERA Desc. variable", "SIDERA Fecha", 
-            "SIDERA TEXTO AÑOS", "SIDERA TEXTO HORAS", "SIDERA TEXTO SEGUNDOS",
-            # Carril headers
-            "CARRIL Equipo", "CARRIL Desc. variable", "CARRIL Fecha", "CARRIL Hora",
-            # Status columns
-            "ESTADO", "ESTADO CARRIL"
-        ]
-        comparison_sheet.append(headers)
-
-        # Process data for comparison sheet
-        debug_stats.total_citi = len(citi_log_file) - 1
-        debug_stats.total_sidera = len(sidera_log_file) - 1
-        debug_stats.total_carriles = len(carriles_log_file) - 1
-
-        if debug:
-            print(f"Processing {debug_stats.total_citi} Citi logs, {debug_stats.total_sidera} Sidera logs, and {debug_stats.total_carriles} Carril logs")
-
-        # Create Log objects (skip headers)
-        citi_logs = [Log(line, True) for line in citi_log_file[1:]]
-        sidera_logs = [Log(line, False) for line in sidera_log_file[1:]]
-        carril_logs = [CarrilLog(line) for line in carriles_log_file[1:]]
-
-        # Process events
-        events = process_citi_sidera_logs(citi_logs, sidera_logs, debug)
-        used_carriles = set()
-
-        # Try to match carriles to existing events
-        for carril_log in carril_logs:
-            if carril_log not in used_carriles:
-                matched = False
-                for event in events:
-                    if event.try_add_carril(carril_log, used_carriles):
-                        used_carriles.add(carril_log)
-                        matched = True
-                if not matched and debug:
-                    debug_stats.carril_matches['unmatched'] += 1
-
-        # Create events for unmatched carriles
+        comparison_sheet.append(row)
+        # Apply formatting based on status
+        if status in STATUS_COLORS:
+            for col in range(1, len(row) + 1):  # Excel columns are 1-based
+                comparison_sheet.cell(row=row_idx, column=col).style = status
+
+    # Create and populate other sheets
+    for title, header, records, sheet_widths in sources:
+        source_rows = raw_rows(None, records)
+        sheet_rows = max_sheet_rows - (header is not None)
+        part = 1
+        next_row = next(source_rows, None)
+        while True:
+            sheet = workbook.create_sheet(title if part == 1 else f"{title} ({part})")
+            set_column_widths(sheet, sheet_widths)
+            if header is not None:
+                sheet.append(header)
+            if next_row is None:
+                break
+            sheet.append(next_row)
+            for row in islice(source_rows, sheet_rows - 1):
+                sheet.append(row)
+            next_row = next(source_rows, None)
+            if next_row is None:
+                break
+            part += 1
+
+    workbook.save(output_path)
+
+def styled_values(cell: 'WriteOnlyCell', row: List) -> Iterator['WriteOnlyCell']:
+    """
+    Yield the row's values through an already styled write-only cell; the
+    sheet writes each cell out before asking for the next one.
+    """
+    for value in row:
+        cell.value = value
+        yield cell
+
+def unique_headers(headers: List[str]) -> List[str]:
+    """Headers with repeated names numbered ("CITILOG IncType", "CITILOG IncType 2")"""
+    seen = Counter()
+    unique = []
+    for header in headers:
+        seen[header] += 1
+        unique.append(header if seen[header] == 1 else f"{header} {seen[header]}")
+    return unique
+
+# Field names of a comparison row as a record; extra data cells go to EXTRA
+RECORD_FIELDS = unique_headers(COMPARISON_HEADERS) + ["EXTRA"]
+
+def row_record(row: List) -> Dict[str, object]:
+    """
+    Comparison row as a record keyed by RECORD_FIELDS. The status columns are
+    always the last two cells of a row; data cells are padded with "" up to
+    the headers, and any beyond them are kept as a list in EXTRA.
+    """
+    data_fields = RECORD_FIELDS[:-3]
+    data = row[:-2]
+    record = dict(zip(data_fields, data))
+    for field in data_fields[len(data):]:
+        record[field] = ""
+    record["ESTADO"] = row[-2]
+    record["ESTADO CARRIL"] = row[-1]
+    record["EXTRA"] = list(data[len(data_fields):])
+    return record
+
+class OutputWriter:
+    """
+    Base class of the output formats. A writer gets the sorted comparison
+    rows (as TrafficEvent.return_list builds them) as an iterable it goes
+    through once, their column widths and the raw sources as (sheet title,
+    header row, records or ExportFile, column widths). write_only and
+    max_sheet_rows only matter to formats with sheets.
+    """
+    extension = ""
+    # Whether the writer needs column widths tracked while rows are produced
+    uses_widths = False
+
+    def __init__(self, output_path: str, write_only: bool = False, max_sheet_rows: int = EXCEL_MAX_ROWS):
+        self.output_path = output_path
+        self.write_only = write_only
+        self.max_sheet_rows = max_sheet_rows
+
+    def write(self, rows: Iterable[List], widths: List[int], sources: List[Tuple[str, Optional[List[str]], List, List[int]]]) -> None:
+        raise NotImplementedError
+
+class XlsxWriter(OutputWriter):
+    """Excel workbook with the comparison sheet and the raw source sheets"""
+    extension = "xlsx"
+    uses_widths = True
+
+    def write(self, rows, widths, sources):
+        write_xlsx(self.output_path, rows, widths, sources, self.write_only, self.max_sheet_rows)
+
+class CsvWriter(OutputWriter):
+    """Comparison rows as a ;-separated UTF-8 file, like the input exports"""
+    extension = "csv"
+
+    def write(self, rows, widths, sources):
+        with open(self.output_path, "w", encoding="utf-8", newline="") as output:
+            writer = csv.writer(output, delimiter=';')
+            writer.writerow(COMPARISON_HEADERS)
+            writer.writerows(rows)
+
+class JsonlWriter(OutputWriter):
+    """One JSON object per comparison row, keyed by RECORD_FIELDS"""
+    extension = "jsonl"
+
+    def write(self, rows, widths, sources):
+        with open(self.output_path, "w", encoding="utf-8") as output:
+            for row in rows:
+                output.write(json.dumps(row_record(row), ensure_ascii=False))
+                output.write("\n")
+
+class ParquetWriter(OutputWriter):
+    """Comparison rows as a Parquet table of string columns (needs pyarrow)"""
+    extension = "parquet"
+    batch_size = 100_000  # Rows per row group
+
+    def write(self, rows, widths, sources):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow)") from e
+
+        schema = pa.schema([(field, pa.string()) for field in RECORD_FIELDS[:-1]]
+                           + [("EXTRA", pa.list_(pa.string()))])
+        with pq.ParquetWriter(self.output_path, schema) as writer:
+            rows = iter(rows)
+            while True:
+                records = [row_record(row) for row in islice(rows, self.batch_size)]
+                if not records:
+                    break
+                writer.write_table(pa.Table.from_pylist(records, schema=schema))
+
+# Output formats selectable with --format
+OUTPUT_FORMATS = {
+    'xlsx': XlsxWriter,
+    'csv': CsvWriter,
+    'jsonl': JsonlWriter,
+    'parquet': ParquetWriter,
+}
+
+def match_events(citi_logs: List[Log], sidera_logs: List[Log], carril_logs: List[CarrilLog], debug: bool = False,
+                 matcher: str = "sweep", workers: int = 1, state_path: Optional[str] = None) -> List[TrafficEvent]:
+    """All events of a reconciliation, carril-only ones last, with the chosen matcher and mode"""
+    stats = current_stats()
+
+    # Process events and try to match carriles to them. The pool pairs
+    # and attaches carriles in one go, so its time all counts as 'pair'
+    if state_path is not None:
+        state = IncrementalState(state_path)
+        try:
+            with stats.phase('pair') as pair, gc_paused():
+                events, used_carriles = match_incremental(citi_logs, sidera_logs, carril_logs, state, matcher, debug)
+                pair['rows'] += len(events)
+        finally:
+            state.close()
+    elif workers > 1:
+        with stats.phase('pair') as pair:
+            events, used_carriles = match_parallel(citi_logs, sidera_logs, carril_logs, matcher, workers, debug)
+            pair['rows'] += len(events)
+    else:
+        with stats.phase('pair') as pair:
+            events = process_citi_sidera_logs(citi_logs, sidera_logs, debug, matcher)
+            pair['rows'] += len(events)
+        with stats.phase('carril_match'):
+            used_carriles = attach_carriles(events, carril_logs, debug)
+    if matcher != "legacy":
+        count_unpaired(events)
+
+    # Create events for unmatched carriles
+    with stats.phase('carril_match') as carril_match:
         for carril_log in carril_logs:
             if carril_log not in used_carriles:
                 event = TrafficEvent(None)
-                event.carril_logs.append(carril_log)
+                event.add_carril(carril_log)
                 events.append(event)
                 used_carriles.add(carril_log)
-                debug_stats.carril_matches['carril_only'] += 1
-
-        # Add data to comparison sheet
-        all_rows = []
-        for event in events:
-            if event.has_content():
-                event_rows = event.return_list()
-                all_rows.extend(event_rows)
+                stats.carril_matches['carril_only'] += 1
+        carril_match['rows'] += len(carril_logs)
+    return events
+
+def stream_id(event: TrafficEvent) -> str:
+    """Camera whose output stream an event's rows go to; carril-only events share one stream"""
+    if event.citi_logs:
+        return event.citi_logs[0].camera_id
+    if event.sidera_logs:
+        return event.sidera_logs[0].camera_id
+    return ""
+
+def sorted_streams(events: List[TrafficEvent], widths: Optional[ColumnWidths] = None) -> List[List[Tuple[int, int, List]]]:
+    """
+    Comparison rows split into one stream per camera, each stream sorted by
+    the rows' precomputed integer sort keys. Rows are numbered in event
+    order, so merging the streams on (sort key, number) gives exactly the
+    order of one stable sort over all rows. Empty rows are skipped and the
+    others measured into `widths` as they are produced.
+
+    The streams are built and sorted in memory: pairing doesn't produce a
+    camera's events in date order, so every row exists before the first one
+    is written. What this saves over sorting one list is the strptime per
+    row and the comparisons across cameras, not memory.
+    """
+    streams: Dict[str, List[Tuple[int, int, List]]] = {}
+    number = 0
+    for event in events:
+        if not event.has_content():
+            continue
+        stream = streams.setdefault(stream_id(event), [])
+        for sort_key, row in event.keyed_rows():
+            if any(cell.strip() if isinstance(cell, str) else cell for cell in row[:-2]):
+                if widths is not None:
+                    widths.add(row)
+                stream.append((sort_key, number, row))
+                number += 1
+    for stream in streams.values():
+        stream.sort(key=lambda keyed_row: keyed_row[0])  # Stable: numbers stay in order
+    return list(streams.values())
+
+def merge_streams(streams: List[List[Tuple[int, int, List]]]) -> Iterator[List]:
+    """Rows of the sorted streams in output order, through a heap-based k-way merge of the in-memory streams"""
+    for _, _, row in heapq.merge(*streams):
+        yield row
+
+class Reconciliation:
+    """
+    Everything one reconciliation produced: the events, the comparison
+    rows as per-camera streams sorted by date (iter_rows() merges them in
+    output order, `rows` as a list; status and carril state are the last
+    two cells of a row), the raw sources as (sheet title, header row,
+    records or ExportFile, column widths), the comparison column widths and the
+    DebugStats with counts and timings.
+    """
+    def __init__(self, events: List[TrafficEvent], streams: List[List[Tuple[int, int, List]]], widths: List[int],
+                 sources: List[Tuple[str, Optional[List[str]], List, List[int]]], stats: DebugStats):
+        self.events = events
+        self.streams = streams
+        self.row_count = sum(map(len, streams))
+        self.widths = widths
+        self.sources = sources
+        self.stats = stats
+        self._rows: Optional[List[List]] = None
+
+    def iter_rows(self) -> Iterator[List]:
+        """Sorted comparison rows, merged from the streams as they are consumed"""
+        return merge_streams(self.streams)
+
+    @property
+    def rows(self) -> List[List]:
+        if self._rows is None:
+            self._rows = list(self.iter_rows())
+        return self._rows
+
+    def statuses(self) -> Counter:
+        """Comparison rows per status"""
+        return Counter(row[-2] for stream in self.streams for _, _, row in stream)
+
+    def write(self, output_path: str, output_format: str = "xlsx", write_only: bool = False, raw_sheets: bool = True,
+              max_sheet_rows: int = EXCEL_MAX_ROWS) -> None:
+        """
+        Write the comparison and the raw sources in one of OUTPUT_FORMATS,
+        streaming the rows in order. Without raw_sheets only the comparison
+        is written; see write_xlsx for max_sheet_rows.
+        """
+        writer = OUTPUT_FORMATS[output_format](output_path, write_only, max_sheet_rows)
+        with self.stats.phase('write') as write:
+            writer.write(self.iter_rows(), self.widths, self.sources if raw_sheets else [])
+            write['rows'] += self.row_count
+
+    def close(self) -> None:
+        """Release what the rows are read back from; nothing when they are in memory"""
+
+    def __enter__(self) -> 'Reconciliation':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class SqliteStore:
+    """
+    A reconciliation kept in a temporary on-disk SQLite database, for the
+    sqlite engine: the parsed exports, the matched events and the
+    comparison rows. Pairing loads one (camera, year, description)
+    component at a time through an index, carriles find their event with
+    a windowed query on the events' (camera prefix, description, minute)
+    and the rows come back sorted from an index, so memory stays bounded
+    however big the exports are. Records are stored as JSON of their slot
+    values and rebuilt with DiskCache.record_from, without parsing them
+    again. The database file goes away when the store is closed.
+    """
+    INSERT_BATCH = 10_000
 
-        # Sort rows by date/time
-        sorted_rows = sorted(all_rows, key=extract_date_for_sorting)
+    def __init__(self):
+        # An empty name is a private temporary database, on disk once it outgrows the page cache
+        self.db = sqlite3.connect("", check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE citi (pos INTEGER PRIMARY KEY, camera TEXT, year TEXT, desc TEXT, minute INTEGER, state TEXT);
+            CREATE TABLE sidera (pos INTEGER PRIMARY KEY, camera TEXT, year TEXT, desc TEXT, minute INTEGER, state TEXT);
+            CREATE TABLE carriles (pos INTEGER PRIMARY KEY, prefix TEXT, desc TEXT, minute INTEGER, state TEXT);
+            CREATE TABLE events (event INTEGER PRIMARY KEY, citi TEXT, sidera TEXT);
+            CREATE TABLE event_logs (prefix TEXT, desc TEXT, minute INTEGER, event INTEGER, is_citi INTEGER);
+            CREATE TABLE event_carriles (event INTEGER, pos INTEGER);
+            CREATE TABLE rows (sort_key INTEGER, number INTEGER, status TEXT, row TEXT);
+        """)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> 'SqliteStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def count(self, table: str) -> int:
+        return self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def load(self, kind: str, source: ExportSource, parse: Callable[[Iterable[List[str]]], Iterator],
+             widths: Optional[ColumnWidths] = None) -> Optional[List[str]]:
+        """Stream an export into the `kind` table a block at a time; returns its header"""
+        stats = current_stats()
+        header = None
+        position = 0
+        for header, records in parsed_blocks(source, parse, widths):
+            with stats.phase('parse'):
+                if kind == 'carriles':
+                    values = [(position + offset, record.camera_prefix, record.desc, record.minute,
+                               json.dumps(DiskCache.record_state(record))) for offset, record in enumerate(records)]
+                    self.db.executemany("INSERT INTO carriles VALUES (?, ?, ?, ?, ?)", values)
+                else:
+                    values = [(position + offset, record.camera_id, record.year, record.desc, record.minute,
+                               json.dumps(DiskCache.record_state(record))) for offset, record in enumerate(records)]
+                    self.db.executemany(f"INSERT INTO {kind} VALUES (?, ?, ?, ?, ?, ?)", values)
+                position += len(records)
+        if kind != 'carriles':
+            with stats.phase('parse'):
+                self.db.execute(f"CREATE INDEX {kind}_component ON {kind} (camera, year, desc, minute)")
+        return header
+
+    def records(self, kind: str) -> 'StoredExport':
+        return StoredExport(self, kind, RECORD_CLASSES[kind])
+
+    def component(self, kind: str, camera: str, year: str, desc: str) -> Tuple[List[Tuple[int, Log]], Dict[int, str]]:
+        """A component's (position, log) group in input order, and each log's stored state by id()"""
+        group = []
+        states = {}
+        rows = self.db.execute(f"SELECT pos, state FROM {kind} WHERE camera = ? AND year = ? AND desc = ? ORDER BY pos",
+                               (camera, year, desc))
+        for position, state in rows:
+            log = DiskCache.record_from(Log, json.loads(state))
+            group.append((position, log))
+            states[id(log)] = state
+        return group, states
+
+    def pair(self, matcher: str) -> int:
+        """
+        Pair every component with `matcher` into the events table, and
+        return how many events there are. An event's number is its place
+        in pair_by_camera's order: cameras in order of first appearance,
+        then Citi-started events by their first Citi log and Sidera-only
+        ones by their first Sidera log. Carril-only events go after all of them.
+        """
+        pair_camera = MATCHERS[matcher]
+        cameras = [camera for camera, in self.db.execute("SELECT camera FROM citi GROUP BY camera ORDER BY MIN(pos)")]
+        cameras += [camera for camera, in self.db.execute("SELECT camera FROM sidera GROUP BY camera ORDER BY MIN(pos)")]
+        cameras = list(dict.fromkeys(cameras))
+        self.stride = 1 + max(self.count('citi'), self.count('sidera'), self.count('carriles'))
+        self.carril_only_base = 2 * len(cameras) * self.stride
+
+        failed_matches = current_stats().failed_matches
+        total = 0
+        for rank, camera in enumerate(cameras):
+            if camera == '?':
+                # ? cameras never match anything, each log is an event
+                for offset, kind in enumerate(('citi', 'sidera')):
+                    base = (2 * rank + offset) * self.stride
+                    logs = "'[' || state || ']'"
+                    columns = f"{logs}, '[]'" if kind == 'citi' else f"'[]', {logs}"
+                    inserted = self.db.execute(f"INSERT INTO events SELECT {base} + pos, {columns} FROM {kind} WHERE camera = '?'").rowcount
+                    failed_matches['question_mark_camera'] += inserted
+                    total += inserted
+                    self.db.execute(f"INSERT INTO event_logs SELECT '?', desc, minute, {base} + pos, {int(kind == 'citi')} "
+                                    f"FROM {kind} WHERE camera = '?' AND minute IS NOT NULL")
+                continue
 
-        # Filter empty rows
-        sorted_rows = [row for row in sorted_rows if any(cell.strip() if isinstance(cell, str) else cell 
-                                                       for cell in row[:-2])]
+            components = self.db.execute("SELECT year, desc FROM citi WHERE camera = ? "
+                                         "UNION SELECT year, desc FROM sidera WHERE camera = ?", (camera, camera)).fetchall()
+            # Each system's component_keys on this camera, for count_unpaired's reasons
+            keys: Dict[bool, Set[tuple]] = {}
+            for kind in ('citi', 'sidera'):
+                keys[kind == 'citi'] = {key for year, desc in self.db.execute(
+                    f"SELECT DISTINCT year, desc FROM {kind} WHERE camera = ?", (camera,)) for key in component_keys(camera, year, desc)}
+            for year, desc in components:
+                citi_group, citi_states = self.component('citi', camera, year, desc)
+                sidera_group, sidera_states = self.component('sidera', camera, year, desc)
+                positions = {id(log): position for position, log in citi_group + sidera_group}
+                events, event_logs = [], []
+                for event in pair_camera(citi_group, sidera_group):
+                    if event.citi_logs:
+                        number = 2 * rank * self.stride + positions[id(event.citi_logs[0])]
+                    else:
+                        number = (2 * rank + 1) * self.stride + positions[id(event.sidera_logs[0])]
+                    events.append((number, '[' + ','.join(citi_states[id(log)] for log in event.citi_logs) + ']',
+                                   '[' + ','.join(sidera_states[id(log)] for log in event.sidera_logs) + ']'))
+                    if not (event.citi_logs and event.sidera_logs):
+                        for log in event.citi_logs or event.sidera_logs:
+                            failed_matches[unpaired_reason(log, keys[not log.is_citi])] += 1
+                    # Unparseable hours never match a carril
+                    event_logs.extend((log.camera_id[:6], log.desc, log.minute, number, log.is_citi)
+                                      for log in event.citi_logs + event.sidera_logs if log.minute is not None)
+                self.db.executemany("INSERT INTO events VALUES (?, ?, ?)", events)
+                self.db.executemany("INSERT INTO event_logs VALUES (?, ?, ?, ?, ?)", event_logs)
+                total += len(events)
+        self.db.execute("CREATE INDEX event_logs_window ON event_logs (prefix, desc, minute, event, is_citi)")
+        return total
+
+    def attach_carriles(self, debug: bool = False) -> None:
+        """
+        Link every carril to the first event it matches, as attach_carriles
+        does, or to a carril-only event of its own.
+        """
+        stats = current_stats()
+        links = []
+        carriles = self.db.execute("SELECT pos, prefix, desc, minute FROM carriles ORDER BY pos")
+        for position, prefix, desc, minute in carriles:
+            stats.comparisons['carril_lookups'] += 1
+            match = None
+            if minute is not None:
+                match = self.db.execute(
+                    "SELECT event, MAX(is_citi) FROM event_logs WHERE prefix = ? AND desc = ? AND minute IN (?, ?, ?) "
+                    "GROUP BY event ORDER BY event LIMIT 1",
+                    (prefix, desc, (minute - 1) % 1440, minute, (minute + 1) % 1440)).fetchone()
+            if match is not None:
+                event, matched_citi = match
+                stats.carril_matches['matched_citi' if matched_citi else 'matched_sidera'] += 1
+            else:
+                if debug:
+                    stats.carril_matches['unmatched'] += 1
+                event = self.carril_only_base + position
+                self.db.execute("INSERT INTO events VALUES (?, '[]', '[]')", (event,))
+                stats.carril_matches['carril_only'] += 1
+            links.append((event, position))
+            if len(links) >= self.INSERT_BATCH:
+                self.db.executemany("INSERT INTO event_carriles VALUES (?, ?)", links)
+                links = []
+        self.db.executemany("INSERT INTO event_carriles VALUES (?, ?)", links)
+        self.db.execute("CREATE INDEX event_carriles_event ON event_carriles (event, pos)")
+
+    def events(self) -> Iterator[TrafficEvent]:
+        """The events in order, with their carriles"""
+        carriles = self.db.execute("SELECT event_carriles.event, carriles.state FROM event_carriles "
+                                   "JOIN carriles ON carriles.pos = event_carriles.pos ORDER BY event_carriles.event, event_carriles.pos")
+        carril = next(carriles, None)
+        for number, citi, sidera in self.db.execute("SELECT event, citi, sidera FROM events ORDER BY event"):
+            event = TrafficEvent(None)
+            event.citi_logs.extend(DiskCache.record_from(Log, state) for state in json.loads(citi))
+            event.sidera_logs.extend(DiskCache.record_from(Log, state) for state in json.loads(sidera))
+            while carril is not None and carril[0] == number:
+                event.add_carril(DiskCache.record_from(CarrilLog, json.loads(carril[1])))
+                carril = next(carriles, None)
+            yield event
+
+    def build_rows(self, widths: Optional[ColumnWidths] = None) -> int:
+        """
+        Store the comparison rows of every event, numbered in event order
+        and measured into `widths` like sorted_streams does, indexed by
+        (sort key, number) for reading them back in output order. Returns
+        how many rows there are.
+        """
+        number = 0
+        rows = []
+        for event in self.events():
+            if not event.has_content():
+                continue
+            for sort_key, row in event.keyed_rows():
+                if any(cell.strip() if isinstance(cell, str) else cell for cell in row[:-2]):
+                    if widths is not None:
+                        widths.add(row)
+                    rows.append((sort_key, number, row[-2], json.dumps(row)))
+                    number += 1
+            if len(rows) >= self.INSERT_BATCH:
+                self.db.executemany("INSERT INTO rows VALUES (?, ?, ?, ?)", rows)
+                rows = []
+        self.db.executemany("INSERT INTO rows VALUES (?, ?, ?, ?)", rows)
+        self.db.execute("CREATE INDEX rows_order ON rows (sort_key, number)")
+        return number
+
+class StoredExport:
+    """The records of an export kept in a SqliteStore, rebuilt in input order each time it is iterated"""
+    def __init__(self, store: SqliteStore, kind: str, record_class):
+        self.store = store
+        self.kind = kind
+        self.record_class = record_class
+
+    def __len__(self) -> int:
+        return self.store.count(self.kind)
+
+    def __iter__(self) -> Iterator:
+        for state, in self.store.db.execute(f"SELECT state FROM {self.kind} ORDER BY pos"):
+            yield DiskCache.record_from(self.record_class, json.loads(state))
+
+class StoredReconciliation(Reconciliation):
+    """
+    A Reconciliation of the sqlite engine. Its rows and sources are read
+    back from the SqliteStore as they are consumed; the events stay there
+    too, so `events` and `streams` are None. Closing it closes the store.
+    """
+    def __init__(self, store: SqliteStore, row_count: int, widths: List[int],
+                 sources: List[Tuple[str, Optional[List[str]], Iterable, List[int]]], stats: DebugStats):
+        self.store = store
+        self.events = None
+        self.streams = None
+        self.row_count = row_count
+        self.widths = widths
+        self.sources = sources
+        self.stats = stats
+        self._rows = None
+
+    def iter_rows(self) -> Iterator[List]:
+        for row, in self.store.db.execute("SELECT row FROM rows ORDER BY sort_key, number"):
+            yield json.loads(row)
+
+    def statuses(self) -> Counter:
+        return Counter(dict(self.store.db.execute("SELECT status, COUNT(*) FROM rows GROUP BY status")))
+
+    def close(self) -> None:
+        self.store.close()
+
+def reconcile_sqlite(citi: ExportSource, sidera: ExportSource, carriles: ExportSource, debug: bool = False,
+                     matcher: str = "sweep", track_widths: bool = True, max_width: Optional[int] = None,
+                     width_sample: int = 1) -> StoredReconciliation:
+    """reconcile() with the sqlite engine: the same output, with the data in a SqliteStore instead of lists"""
+    stats = DebugStats()
+    store = SqliteStore()
+    try:
+        with collecting(stats):
+            citi_widths = ColumnWidths.tracker(track_widths, max_width, width_sample)
+            sidera_widths = ColumnWidths.tracker(track_widths, max_width, width_sample)
+            carriles_widths = ColumnWidths.tracker(track_widths, max_width, width_sample)
+            citi_header = store.load('citi', citi, lambda rows: parse_logs(rows, True), citi_widths)
+            sidera_header = store.load('sidera', sidera, lambda rows: parse_logs(rows, False), sidera_widths)
+            carriles_header = store.load('carriles', carriles, parse_carriles, carriles_widths)
+
+            stats.total_citi = store.count('citi')
+            stats.total_sidera = store.count('sidera')
+            stats.total_carriles = store.count('carriles')
+
+            with stats.phase('pair') as pair:
+                pair['rows'] += store.pair(matcher)
+            with stats.phase('carril_match') as carril_match:
+                store.attach_carriles(debug)
+                carril_match['rows'] += stats.total_carriles
+            with stats.phase('sort') as sort:
+                comparison_widths = ColumnWidths.tracker(track_widths, max_width, width_sample)
+                if comparison_widths is not None:
+                    comparison_widths.add(COMPARISON_HEADERS)
+                row_count = store.build_rows(comparison_widths)
+                sort['rows'] += row_count
+
+        sources = [
+            ("Citi", citi_header, source_records(citi, store.records('citi')), ColumnWidths.widths_of(citi_widths)),
+            ("Sidera", sidera_header, source_records(sidera, store.records('sidera')), ColumnWidths.widths_of(sidera_widths)),
+            ("Carriles", carriles_header, source_records(carriles, store.records('carriles')), ColumnWidths.widths_of(carriles_widths)),
+        ]
+        return StoredReconciliation(store, row_count, ColumnWidths.widths_of(comparison_widths), sources, stats)
+    except BaseException:
+        store.close()
+        raise
+
+def option_conflict(matcher: str = "sweep", engine: str = "objects", workers: int = 1, parse_workers: int = 1,
+                    state_path: Optional[str] = None, cached: bool = False) -> Optional[str]:
+    """Why these reconcile() options can't go together, None when they can"""
+    if engine == "sqlite" and (workers > 1 or parse_workers > 1 or state_path is not None or cached or matcher == "legacy"):
+        return ("the sqlite engine pairs with the sweep or optimal matcher, "
+                "without --workers, --parse-workers, --state or --cache-dir")
+    if state_path is not None and matcher == "legacy":
+        return "--state pairs with the sweep or optimal matcher, the legacy one counts failed matches across all of a camera"
+    return None
+
+def reconcile(citi: ExportSource, sidera: ExportSource, carriles: ExportSource, debug: bool = False, matcher: str = "sweep",
+              engine: str = "objects", workers: int = 1, state_path: Optional[str] = None, track_widths: bool = True,
+              max_width: Optional[int] = None, width_sample: int = 1, cache: Optional[ExportCache] = None,
+              disk_cache: Optional[DiskCache] = None, parse_workers: int = 1) -> Reconciliation:
+    """
+    Reconcile a Citi, Sidera and Carriles export, given as file paths or
+    iterables of rows (header first), without writing anything. Counters go
+    to a DebugStats of this call only, so calls can run side by side in
+    threads. Column widths are only measured with track_widths, which only
+    the XLSX output needs. Exports given as paths are taken from `cache`
+    while their files don't change, and with `disk_cache` both the parsed
+    exports and the matched events are reused across runs. With
+    parse_workers > 1 the exports are read and parsed on a process pool
+    (see load_exports) unless a cache has them. The sqlite engine keeps
+    everything in a temporary database instead (see SqliteStore).
+    """
+    conflict = option_conflict(matcher, engine, workers, parse_workers, state_path, cache is not None or disk_cache is not None)
+    if conflict is not None:
+        raise ValueError(conflict)
+    if engine == "sqlite":
+        return reconcile_sqlite(citi, sidera, carriles, debug, matcher, track_widths, max_width, width_sample)
+
+    stats = DebugStats()
+    with collecting(stats):
+        # Read input files straight into Log objects (skip headers)
+        # measuring the raw sheets' column widths on the way
+        citi_widths = ColumnWidths.tracker(track_widths, max_width, width_sample)
+        sidera_widths = ColumnWidths.tracker(track_widths, max_width, width_sample)
+        carriles_widths = ColumnWidths.tracker(track_widths, max_width, width_sample)
+        def load(source: ExportSource, kind: str, parse: Callable, widths: Optional[ColumnWidths]) -> Tuple[Optional[List[str]], List]:
+            if isinstance(source, (str, os.PathLike)):
+                if cache is not None:
+                    return cache.load(source, kind, parse, widths)
+                if disk_cache is not None:
+                    return disk_cache.load(source, kind, parse, widths)
+            return load_export(source, parse, widths)
+
+        if parse_workers > 1 and cache is None and disk_cache is None:
+            (citi_header, citi_logs), (sidera_header, sidera_logs), (carriles_header, carril_logs) = load_exports(
+                [(citi, 'citi', citi_widths), (sidera, 'sidera', sidera_widths), (carriles, 'carriles', carriles_widths)],
+                parse_workers)
+        else:
+            citi_header, citi_logs = load(citi, 'citi', lambda rows: parse_logs(rows, True), citi_widths)
+            sidera_header, sidera_logs = load(sidera, 'sidera', lambda rows: parse_logs(rows, False), sidera_widths)
+            carriles_header, carril_logs = load(carriles, 'carriles', parse_carriles, carriles_widths)
 
-        # Add rows to sheet with formatting
-        for row_idx, row in enumerate(sorted_rows, start=2):  # start=2 because row 1 is headers
-            comparison_sheet.append(row)
-            
-            # Get the status (second to last column)
-            status = row[-2]
-            
-            # Apply formatting based on status
-            if status in styles:
-                for col in range(1, len(row) + 1):  # Excel columns are 1-based
-                    cell = comparison_sheet.cell(row=row_idx, column=col)
-                    cell.fill = styles[status]['fill']
-                    cell.font = styles[status]['font']
-
-        # Create and populate other sheets
-        citi_sheet = workbook.create_sheet("Citi")
-        for row in citi_log_file:
-            citi_sheet.append(row)
-
-        sidera_sheet = workbook.create_sheet("Sidera")
-        for row in sidera_log_file:
-            sidera_sheet.append(row)
-
-        carriles_sheet = workbook.create_sheet("Carriles")
-        for row in carriles_log_file:
-            carriles_sheet.append(row)
-
-        # Auto-adjust column widths for all sheets
-        for sheet in workbook.sheetnames:
-            for column in workbook[sheet].columns:
-                max_length = 0
-                column = list(column)
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = (max_length + 2)
-                workbook[sheet].column_dimensions[column[0].column_letter].width = adjusted_width
-
-        print(f"\nWriting {output_path}...")
-        workbook.save(output_path)
-        print(f"Successfully saved {output_path}")
+        # Process data for comparison sheet
+        stats.total_citi = len(citi_logs)
+        stats.total_sidera = len(sidera_logs)
+        stats.total_carriles = len(carril_logs)
+
+        # Events come from the disk cache when the same inputs were matched
+        # with the same parameters before, counters and phase rows included.
+        # --state keeps its own store, with counters of its own
+        paths = [citi, sidera, carriles]
+        events_key = None
+        if disk_cache is not None and state_path is None and all(isinstance(source, (str, os.PathLike)) for source in paths):
+            events_key = disk_cache.key('events', [disk_cache.file_digest(path) for path in paths], matcher, debug)
+        stored = disk_cache.get(events_key) if events_key is not None else None
+        if stored is not None:
+            positions, counters = stored
+            with stats.phase('pair'):
+                events = events_from_positions(positions, citi_logs, sidera_logs, carril_logs)
+            stats.merge(DiskCache.stats_from(counters))
+        else:
+            matched = DebugStats()
+            with collecting(matched):
+                events = match_events(citi_logs, sidera_logs, carril_logs, debug, matcher, workers, state_path)
+            stats.merge(matched)
+            if events_key is not None:
+                disk_cache.put(events_key, (event_positions(events, citi_logs, sidera_logs, carril_logs),
+                                            DiskCache.stats_state(matched)))
+
+        # Comparison rows in per-camera streams sorted by the keys each log
+        # precomputed, measuring column widths as rows are produced
+        with stats.phase('sort') as sort:
+            comparison_widths = ColumnWidths.tracker(track_widths, max_width, width_sample)
+            if comparison_widths is not None:
+                comparison_widths.add(COMPARISON_HEADERS)
+            streams = sorted_streams(events, comparison_widths)
+            sort['rows'] += sum(map(len, streams))
+
+    # Raw sheets of exports given as paths are written from the files again
+    sources = [
+        ("Citi", citi_header, source_records(citi, citi_logs), ColumnWidths.widths_of(citi_widths)),
+        ("Sidera", sidera_header, source_records(sidera, sidera_logs), ColumnWidths.widths_of(sidera_widths)),
+        ("Carriles", carriles_header, source_records(carriles, carril_logs), ColumnWidths.widths_of(carriles_widths)),
+    ]
+    return Reconciliation(events, streams, ColumnWidths.widths_of(comparison_widths), sources, stats)
+
+# Hot-path functions whose call counts and cumulative times --profile reports:
+# parsing, pairing (sweep buckets, and the comparisons of the legacy matcher),
+# carril lookups, row building and the output writers
+PROFILED_PRIMITIVES: Dict[str, Callable] = {
+    'Log.__init__': Log.__init__,
+    'time_to_minutes': time_to_minutes,
+    'parse_sort_key': parse_sort_key,
+    'TimeWindowBuckets.__init__': TimeWindowBuckets.__init__,
+    'TimeWindowBuckets.take_first': TimeWindowBuckets.take_first,
+    'TimeWindowBuckets.take_all': TimeWindowBuckets.take_all,
+    'Log.compare': Log.compare,
+    'TrafficEvent.add_if_same': TrafficEvent.add_if_same,
+    'CarrilIndex.__init__': CarrilIndex.__init__,
+    'CarrilIndex.find': CarrilIndex.find,
+    'TrafficEvent.keyed_rows': TrafficEvent.keyed_rows,
+    'write_xlsx': write_xlsx,
+    'styled_values': styled_values,
+    'CsvWriter.write': CsvWriter.write,
+    'JsonlWriter.write': JsonlWriter.write,
+    'row_record': row_record,
+    'ParquetWriter.write': ParquetWriter.write,
+}
+
+class Profiler:
+    """
+    cProfile over a block, plus a thread sampling the profiled thread's
+    stack every `interval` seconds. On exit writes <prefix>.pstats, for
+    pstats or snakeviz, and <prefix>.collapsed with one "frame;frame count"
+    line per sampled stack, as flamegraph.pl and speedscope read them.
+    The hot paths carry no instrumentation of their own, so runs without a
+    Profiler pay nothing for it. Worker processes aren't profiled.
+    """
+    def __init__(self, prefix: str, interval: float = 0.005):
+        self.prefix = prefix
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def __enter__(self) -> 'Profiler':
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        self._sampler.start()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.profile.disable()
+        self._stop.set()
+        self._sampler.join()
+        self.profile.dump_stats(self.prefix + '.pstats')
+        with open(self.prefix + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.items():
+                f.write(f"{stack} {count}\n")
+
+    def primitives(self) -> Dict[str, Dict[str, float]]:
+        """Calls and cumulative seconds of each PROFILED_PRIMITIVES function that ran"""
+        self.profile.create_stats()
+        names = {(function.__code__.co_filename, function.__code__.co_firstlineno, function.__code__.co_name): name
+                 for name, function in PROFILED_PRIMITIVES.items()}
+        return {names[key]: {'calls': calls, 'seconds': cumulative}
+                for key, (_, calls, _, cumulative, _) in self.profile.stats.items() if key in names}
+
+def compare_files(citi_path: str, sidera_path: str, carriles_path: str, debug: bool = False, output_path: str = "output.xlsx", matcher: str = "sweep", write_only: bool = False,
+                  max_width: Optional[int] = None, width_sample: int = 1, output_format: str = "xlsx", workers: int = 1,
+                  state_path: Optional[str] = None, metrics_path: Optional[str] = None, engine: str = "objects",
+                  cache_dir: Optional[str] = None, cache_size_mb: int = 1024, profile_path: Optional[str] = None,
+                  raw_sheets: bool = True, max_sheet_rows: int = EXCEL_MAX_ROWS, parse_workers: int = 1) -> DebugStats:
+    """Command line run: reconcile, write the output, print the summary and return the DebugStats"""
+    print("Iniciando comparación...")
+    start_time = time.time()
+    
+    try:
+        disk_cache = DiskCache(cache_dir, cache_size_mb << 20) if cache_dir is not None else None
+        profiler = Profiler(profile_path) if profile_path is not None else None
+        with profiler if profiler is not None else nullcontext():
+            with reconcile(citi_path, sidera_path, carriles_path, debug, matcher, engine, workers, state_path,
+                           OUTPUT_FORMATS[output_format].uses_widths, max_width, width_sample, disk_cache=disk_cache,
+                           parse_workers=parse_workers) as result:
+                if debug:
+                    print(f"Processed {result.stats.total_citi} Citi logs, {result.stats.total_sidera} Sidera logs, "
+                          f"and {result.stats.total_carriles} Carril logs")
+                print(f"\nWriting {output_path}...")
+                result.write(output_path, output_format, write_only, raw_sheets, max_sheet_rows)
+                print(f"Successfully saved {output_path}")
+        if profiler is not None:
+            result.stats.primitives = profiler.primitives()
+            print(f"Perfil escrito en {profile_path}.pstats y {profile_path}.collapsed")
         
         end_time = time.time()
         execution_time = end_time - start_time
         print(f"\nExecution time: {execution_time:.2f} seconds")
         
         # Print statistics
-        debug_stats.print_summary()
+        result.stats.print_summary()
+        if metrics_path is not None:
+            result.stats.to_json(metrics_path)
+        return result.stats
         
     except Exception as e:
         print(f"Error during comparison: {e}")
@@ -661,7 +2680,47 @@ if __name__ == "__main__":
     parser.add_argument('sidera_path', help='Path to Sidera log file')
     parser.add_argument('carriles_path', help='Path to Carriles log file')
     parser.add_argument('--debug', action='store_true', help='Enable debug output')
-    parser.add_argument('--output', default='output.xlsx', help='Output file path (default: output.xlsx)')
+    parser.add_argument('--output', default=None, help='Output file path (default: output.<format>)')
+    parser.add_argument('--format', dest='output_format', choices=list(OUTPUT_FORMATS), default='xlsx',
+                        help='Output format (default: xlsx)')
+    parser.add_argument('--matcher', choices=sorted(MATCHERS), default='sweep',
+                        help='Citi/Sidera pairing strategy (default: sweep, legacy is the original all-pairs scan, '
+                             'optimal pairs bursts of duplicates with the most pairs and smallest time differences)')
+    parser.add_argument('--write-only', action='store_true',
+                        help='Stream the workbook to disk with openpyxl write-only mode (less memory for big outputs)')
+    parser.add_argument('--max-width', type=int, default=None,
+                        help='Cap on column widths (default: no cap)')
+    parser.add_argument('--width-sample', type=int, default=1,
+                        help='Measure column widths on one row out of every N (default: 1, every row)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes used for matching, partitioned by camera (default: 1, no pool)')
+    parser.add_argument('--parse-workers', type=int, default=1,
+                        help='Processes reading and parsing the three exports, big files in line-aligned chunks (default: 1, no pool)')
+    parser.add_argument('--state', default=None,
+                        help='SQLite file keeping paired events between runs, only the runs of minutes holding changed rows are paired again')
+    parser.add_argument('--metrics', dest='metrics_path', default=None,
+                        help='Write the run counters and per-phase times to this JSON file')
+    parser.add_argument('--engine', choices=['objects', 'sqlite'], default='objects',
+                        help='Matching engine (default: objects, sqlite works out of a temporary SQLite database '
+                             'with bounded memory for inputs that don\'t fit in it)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory caching parsed inputs and matched events by content hash, reused while inputs and options are unchanged')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Size limit of --cache-dir in MB, least recently used entries go first (default: 1024)')
+    parser.add_argument('--no-raw-sheets', dest='raw_sheets', action='store_false',
+                        help='Leave the Citi, Sidera and Carriles sheets out of the workbook')
+    parser.add_argument('--max-sheet-rows', type=sheet_rows, default=EXCEL_MAX_ROWS,
+                        help=f'Rows per raw source sheet, header included, before going on to a "<sheet> (2)" sheet (default: {EXCEL_MAX_ROWS}, the Excel limit)')
+    parser.add_argument('--profile', dest='profile_path', default=None,
+                        help='Profile the run into PREFIX.pstats (cProfile) and PREFIX.collapsed (stacks for flame graphs), '
+                             'and report call counts and times of the matching primitives')
     args = parser.parse_args()
+    conflict = option_conflict(args.matcher, args.engine, args.workers, args.parse_workers, args.state, args.cache_dir is not None)
+    if conflict is not None:
+        parser.error(conflict)
+    output_path = args.output or f"output.{OUTPUT_FORMATS[args.output_format].extension}"
     
-    compare_files(args.citi_path, args.sidera_path, args.carriles_path, args.debug, args.output)
+    compare_files(args.citi_path, args.sidera_path, args.carriles_path, args.debug, output_path, args.matcher, args.write_only,
+                  args.max_width, args.width_sample, args.output_format, args.workers, args.state,
+                  args.metrics_path, args.engine, args.cache_dir, args.cache_size, args.profile_path,
+                  args.raw_sheets, args.max_sheet_rows, args.parse_workers)
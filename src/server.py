@@ -0,0 +1,327 @@
+import base64
+import json
+import os
+import signal
+import socketserver
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import lol
+
+EXPORT_KINDS = ("citi", "sidera", "carriles")
+
+CONTENT_TYPES = {
+    'xlsx': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    'csv': "text/csv; charset=utf-8",
+    'jsonl': "application/x-ndjson; charset=utf-8",
+    'parquet': "application/vnd.apache.parquet",
+}
+
+# Per worker process, set up once by init_worker
+worker_cache: Optional[lol.ExportCache] = None
+worker_disk_cache: Optional[lol.DiskCache] = None
+
+def init_worker(cache_dir: Optional[str], cache_size_mb: int, preload_xlsx: bool) -> None:
+    """Warm up a worker before its first job, so jobs don't pay for imports"""
+    global worker_cache, worker_disk_cache
+    # Ignore Ctrl+C, see watch.init_worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_cache = lol.ExportCache()
+    if cache_dir is not None:
+        worker_disk_cache = lol.DiskCache(cache_dir, cache_size_mb * 1024 * 1024)
+    if preload_xlsx:
+        lol.import_openpyxl()
+
+def run_job(job: Dict) -> Dict:
+    """
+    Reconcile one job in a worker process and write its output. Exports given
+    as paths stay parsed in the worker's ExportCache until a job with other
+    paths comes, so comparing the same triplet again (with another matcher
+    or format) only parses what changed. Returns what the response reports.
+    """
+    start = time.perf_counter()
+    paths = [job[kind] for kind in EXPORT_KINDS]
+    options = dict(debug=False, matcher=job['matcher'], engine=job['engine'],
+                   track_widths=lol.OUTPUT_FORMATS[job['format']].uses_widths)
+    if job['engine'] != 'sqlite':
+        worker_cache.prune(paths)
+        options.update(cache=worker_cache, disk_cache=worker_disk_cache)
+    with lol.reconcile(*paths, **options) as result:
+        result.write(job['output'], job['format'], job['write_only'], job['raw_sheets'])
+        return {
+            'output': job['output'],
+            'rows': result.row_count,
+            'statuses': dict(result.statuses()),
+            'stats': result.stats.to_dict(),
+            'seconds': time.perf_counter() - start,
+        }
+
+class JobError(Exception):
+    """A request the server can't run, answered with 400"""
+
+def resolve_within(root: str, path: str) -> str:
+    """
+    `path`, relative paths taken from `root`, with symlinks resolved.
+    Raises JobError when it falls outside `root`, so clients can't reach
+    other files the server can read or write.
+    """
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise JobError(f"{path} is outside {root}")
+    return resolved
+
+def flag(request: Dict, name: str, default: bool) -> bool:
+    """A boolean option of a request, which has to be a JSON true or false"""
+    value = request.get(name, default)
+    if not isinstance(value, bool):
+        raise JobError(f"{name}: expected true or false, got {value!r}")
+    return value
+
+class CompareServer:
+    """
+    Keeps a pool of warm worker processes and runs the comparison jobs the
+    handler hands it. At most `workers` jobs run at once and `queue_size`
+    more wait for a worker; past that, jobs are turned away so a burst of
+    requests doesn't pile up memory, and request bodies are capped at
+    `max_body_mb`. Exports given as paths have to be under `input_root`
+    and reports left on disk under `output_dir`; without them, only
+    uploads and reports sent back are accepted. A pool broken by a worker
+    that died is replaced, failing only the jobs it was running.
+    """
+    def __init__(self, workers: int = 2, queue_size: int = 4, cache_dir: Optional[str] = None,
+                 cache_size_mb: int = 1024, preload_xlsx: bool = True, input_root: Optional[str] = None,
+                 output_dir: Optional[str] = None, max_body_mb: int = 256):
+        self.workers = workers
+        self.input_root = input_root
+        self.output_dir = output_dir
+        self.max_body_bytes = max_body_mb << 20
+        self.initargs = (cache_dir, cache_size_mb, preload_xlsx)
+        self.pool = self.start_pool()
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def start_pool(self) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=self.initargs)
+        # Start the workers now rather than on the first job
+        for future in [pool.submit(time.sleep, 0) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def replace_pool(self, broken: ProcessPoolExecutor) -> None:
+        """Start a new pool in place of a broken one, once however many jobs saw it break"""
+        with self.lock:
+            if self.pool is not broken:
+                return
+            self.pool = self.start_pool()
+        broken.shutdown(wait=False)
+
+    def acquire(self) -> bool:
+        """Take a slot for one request before reading its body; False when every slot is taken"""
+        if not self.slots.acquire(blocking=False):
+            return False
+        with self.lock:
+            self.pending += 1
+        return True
+
+    def release(self) -> None:
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def compare(self, request: Dict) -> Tuple[Dict, Optional[bytes]]:
+        """
+        Run one comparison request in a slot taken with acquire(). With an
+        "output" path the report is left there and only the summary comes
+        back; otherwise the report's bytes come back too.
+        """
+        output_format = request.get('format', 'xlsx')
+        if output_format not in lol.OUTPUT_FORMATS:
+            raise JobError(f"unknown format {output_format!r}, expected one of {', '.join(lol.OUTPUT_FORMATS)}")
+        matcher = request.get('matcher', 'sweep')
+        if matcher not in lol.MATCHERS:
+            raise JobError(f"unknown matcher {matcher!r}, expected one of {', '.join(sorted(lol.MATCHERS))}")
+        engine = request.get('engine', 'objects')
+        if engine not in ('objects', 'sqlite'):
+            raise JobError(f"unknown engine {engine!r}")
+        write_only = flag(request, 'write_only', False)
+        raw_sheets = flag(request, 'raw_sheets', True)
+
+        with tempfile.TemporaryDirectory(prefix="lol-job-") as tmp:
+            job = {kind: self.export_path(request, kind, tmp) for kind in EXPORT_KINDS}
+            output_path = self.report_path(request.get('output'))
+            job.update(format=output_format, matcher=matcher, engine=engine, write_only=write_only, raw_sheets=raw_sheets,
+                       output=output_path or os.path.join(tmp, f"output.{lol.OUTPUT_FORMATS[output_format].extension}"))
+            pool = self.pool
+            try:
+                summary = pool.submit(run_job, job).result()
+            except BrokenProcessPool:
+                self.replace_pool(pool)
+                raise
+            if output_path:
+                return summary, None
+            with open(job['output'], 'rb') as f:
+                return summary, f.read()
+
+    def export_path(self, request: Dict, kind: str, tmp: str) -> str:
+        """Path of one export: a file under input_root, or where its uploaded bytes were saved"""
+        source = request.get(kind)
+        if isinstance(source, str):
+            if self.input_root is None:
+                raise JobError(f"{kind}: paths are not accepted, upload the file or start the server with --input-root")
+            path = resolve_within(self.input_root, source)
+            if not os.path.isfile(path):
+                raise JobError(f"{kind}: {source} is not a file")
+            return path
+        if isinstance(source, dict) and 'content' in source:
+            path = os.path.join(tmp, f"{kind}.csv")
+            with open(path, 'wb') as f:
+                f.write(base64.b64decode(source['content']))
+            return path
+        raise JobError(f"{kind}: expected a path or {{\"content\": <base64>}}")
+
+    def report_path(self, output: Optional[str]) -> Optional[str]:
+        """Where to leave a report asked for with "output", under output_dir; None to send it back"""
+        if not output:
+            return None
+        if not isinstance(output, str):
+            raise JobError("output: expected a path")
+        if self.output_dir is None:
+            raise JobError("output: reports are not left on disk, start the server with --output-dir")
+        path = resolve_within(self.output_dir, output)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def health(self) -> Dict:
+        with self.lock:
+            return {'workers': self.workers, 'pending': self.pending}
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+class CompareHandler(BaseHTTPRequestHandler):
+    """
+    POST /compare with a JSON body: "citi", "sidera" and "carriles", each a
+    path under the server's input root or {"content": <base64 of the file>},
+    and optionally "format", "matcher", "engine", "write_only", "raw_sheets"
+    and "output" (where to leave the report, under the server's output
+    directory). GET /health reports the load.
+    """
+    server_version = "lol-server"
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self.send_json(404, {'error': f"no such endpoint {self.path}"})
+        self.send_json(200, self.server.compare_server.health())
+
+    def do_POST(self):
+        if self.path != '/compare':
+            return self.send_json(404, {'error': f"no such endpoint {self.path}"})
+        compare_server = self.server.compare_server
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            return self.send_json(400, {'error': "invalid Content-Length"})
+        # The body is left unread on these two, so don't keep the connection
+        if length > compare_server.max_body_bytes:
+            self.close_connection = True
+            return self.send_json(413, {'error': f"request body over {compare_server.max_body_bytes >> 20} MB"})
+        if not compare_server.acquire():
+            self.close_connection = True
+            return self.send_json(503, {'error': "too many jobs, try again later"})
+        try:
+            request = json.loads(self.rfile.read(length))
+            if not isinstance(request, dict):
+                raise JobError("expected a JSON object")
+            summary, report = compare_server.compare(request)
+        except (JobError, ValueError) as e:
+            # json.JSONDecodeError and binascii.Error are ValueErrors too
+            return self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            # BrokenProcessPool included: the pool is replaced for the next jobs
+            return self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+        finally:
+            compare_server.release()
+
+        if report is None:
+            return self.send_json(200, summary)
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[request.get('format', 'xlsx')])
+        self.send_header('Content-Length', str(len(report)))
+        self.send_header('X-Rows', str(summary['rows']))
+        self.send_header('X-Seconds', f"{summary['seconds']:.3f}")
+        self.end_headers()
+        self.wfile.write(report)
+
+    def send_json(self, code: int, body: Dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', "application/json; charset=utf-8")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ThreadingHTTPServer on a Unix socket, for callers on the same machine"""
+    daemon_threads = True
+
+class UnixCompareHandler(CompareHandler):
+    def address_string(self):
+        # Unix socket clients have no host/port to log
+        return "unix"
+
+def serve(compare_server: CompareServer, host: str = "127.0.0.1", port: int = 8765,
+          socket_path: Optional[str] = None) -> None:
+    """Answer requests until interrupted, over TCP or on a Unix socket"""
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        httpd = UnixHTTPServer(socket_path, UnixCompareHandler)
+        where = socket_path
+    else:
+        httpd = ThreadingHTTPServer((host, port), CompareHandler)
+        where = f"http://{host}:{port}"
+    httpd.compare_server = compare_server
+    print(f"Esperando comparaciones en {where} con {compare_server.workers} procesos...")
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve Citi, Sidera, and Carriles comparisons from warm worker processes')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on (default: 127.0.0.1); there is no authentication, anyone reaching it can run jobs')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port to listen on (default: 8765)')
+    parser.add_argument('--socket', dest='socket_path', default=None, help='Listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=2, help='Comparisons run at once (default: 2)')
+    parser.add_argument('--queue-size', type=int, default=4, help='Comparisons waiting for a worker before new ones are refused (default: 4)')
+    parser.add_argument('--input-root', default=None,
+                        help='Accept exports given as paths, relative to and only inside this directory (default: uploads only)')
+    parser.add_argument('--output-dir', default=None,
+                        help='Accept "output" paths, relative to and only inside this directory (default: reports are sent back)')
+    parser.add_argument('--max-body-mb', type=int, default=256,
+                        help='Largest request body accepted, uploads included, in MB (default: 256)')
+    parser.add_argument('--cache-dir', default=None, help='Keep parsed exports and matched events in this directory between jobs')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Size limit of --cache-dir in MB (default: 1024)')
+    parser.add_argument('--no-preload-xlsx', dest='preload_xlsx', action='store_false',
+                        help="Don't import openpyxl in the workers until an XLSX job needs it")
+    args = parser.parse_args()
+
+    compare_server = CompareServer(args.workers, args.queue_size, args.cache_dir, args.cache_size, args.preload_xlsx,
+                                   args.input_root, args.output_dir, args.max_body_mb)
+    try:
+        serve(compare_server, args.host, args.port, args.socket_path)
+    except KeyboardInterrupt:
+        print("Deteniendo...")
+    finally:
+        compare_server.close()
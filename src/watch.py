@@ -0,0 +1,175 @@
+import asyncio
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import lol
+from batch import find_triplets
+
+Signature = Tuple[Tuple[int, int], ...]
+
+def triplet_signature(paths: Tuple[str, str, str]) -> Optional[Signature]:
+    """(mtime, size) of the three files, None if one of them is gone"""
+    try:
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in map(os.stat, paths))
+    except FileNotFoundError:
+        return None
+
+# Parsed exports of the sites routed to this worker process, set up by init_worker
+worker_cache: Optional[lol.ExportCache] = None
+
+def init_worker() -> None:
+    global worker_cache
+    # Ctrl+C reaches the whole process group, workers included. They ignore it
+    # and the watcher shuts them down itself, finishing their jobs (the server's
+    # workers do the same)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_cache = lol.ExportCache()
+
+def prune_worker_cache(paths: Iterable[str]) -> None:
+    """Forget, in this worker, the exports of files no longer watched"""
+    worker_cache.prune(paths)
+
+def reconcile_site(task: Tuple[str, Tuple[str, str, str], str, bool, Dict]) -> int:
+    """Reconcile one site in its worker process and write its output and metrics; returns the row count"""
+    output_path, paths, output_format, write_only, options = task
+    with lol.reconcile(*paths, track_widths=lol.OUTPUT_FORMATS[output_format].uses_widths,
+                       cache=worker_cache, **options) as result:
+        result.write(output_path, output_format, write_only)
+    result.stats.to_json(os.path.splitext(output_path)[0] + ".json")
+    return result.row_count
+
+class Watcher:
+    """
+    Reconciles the triplets of a watched directory (one subdirectory per
+    site, as batch.py reads them) when they are new or change. A triplet is
+    complete once its files look the same on two scans in a row, so files
+    still being copied are left alone. Complete triplets go through a
+    bounded queue: when the workers fall behind, scanning waits. Each
+    worker is a process of its own, so sites are reconciled in parallel,
+    and a site always goes to the same one: parsed exports stay in that
+    process's ExportCache, so a site whose Sidera export changed doesn't
+    parse its Citi and Carriles exports again. A worker that dies is
+    started again, with an empty cache.
+    """
+    def __init__(self, directory: str, output_dir: str, workers: int = 2, queue_size: int = 4, interval: float = 2.0,
+                 output_format: str = "xlsx", write_only: bool = False, **options):
+        self.directory = directory
+        self.output_dir = output_dir
+        self.workers = workers
+        self.interval = interval
+        self.output_format = output_format
+        self.write_only = write_only
+        self.options = options
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.pools: List[ProcessPoolExecutor] = []
+        self.routes: Dict[str, int] = {}
+        self.watched_paths: Set[str] = set()
+        self.last_seen: Dict[str, Signature] = {}
+        self.done: Dict[str, Signature] = {}
+        self.pending: Set[str] = set()
+
+    def worker_for(self, site: str) -> int:
+        """The worker a site is reconciled on, the same one every time so its cache stays warm"""
+        if site not in self.routes:
+            self.routes[site] = len(self.routes) % len(self.pools)
+        return self.routes[site]
+
+    def replace_pool(self, index: int, broken: ProcessPoolExecutor) -> None:
+        """Start a new worker process in place of one that died, unless that was done already"""
+        if self.pools[index] is broken:
+            self.pools[index] = ProcessPoolExecutor(max_workers=1, initializer=init_worker)
+            broken.shutdown(wait=False)
+
+    async def scan(self, assume_complete: bool = False) -> None:
+        """Queue every complete triplet that changed since it was last reconciled"""
+        triplets = find_triplets(self.directory)
+        watched_paths = {path for _, *paths in triplets for path in paths}
+        if watched_paths != self.watched_paths:
+            # Queued behind the jobs already sent, each worker process has one
+            for index, pool in enumerate(self.pools):
+                try:
+                    pool.submit(prune_worker_cache, watched_paths)
+                except BrokenProcessPool:
+                    # Its replacement starts with nothing to prune
+                    self.replace_pool(index, pool)
+            self.watched_paths = watched_paths
+        for site, *paths in triplets:
+            signature = triplet_signature(tuple(paths))
+            stable = assume_complete or self.last_seen.get(site) == signature
+            self.last_seen[site] = signature
+            if signature is None or not stable or self.done.get(site) == signature or site in self.pending:
+                continue
+            self.pending.add(site)
+            await self.queue.put((site, tuple(paths), signature, time.time()))
+
+    async def work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            site, paths, signature, queued_at = await self.queue.get()
+            try:
+                output_path = os.path.join(self.output_dir, f"{site}.{lol.OUTPUT_FORMATS[self.output_format].extension}")
+                task = (output_path, paths, self.output_format, self.write_only, self.options)
+                index = self.worker_for(site)
+                pool = self.pools[index]
+                row_count = await loop.run_in_executor(pool, reconcile_site, task)
+                print(f"{site}: {row_count} filas -> {output_path} "
+                      f"({time.time() - queued_at:.1f} s desde que se detectó)")
+            except BrokenProcessPool:
+                print(f"{site}: el proceso de trabajo terminó inesperadamente, se vuelve a iniciar")
+                self.replace_pool(index, pool)
+            except Exception as e:
+                print(f"{site}: error durante la comparación: {e}")
+            finally:
+                # A failed triplet is retried once its files change again
+                self.done[site] = signature
+                self.pending.discard(site)
+                self.queue.task_done()
+
+    async def run(self, once: bool = False) -> None:
+        """Watch until cancelled; with `once`, reconcile what is there now and return"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.pools = [ProcessPoolExecutor(max_workers=1, initializer=init_worker) for _ in range(self.workers)]
+        try:
+            workers = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+            try:
+                if once:
+                    await self.scan(assume_complete=True)
+                    await self.queue.join()
+                    return
+                print(f"Vigilando {self.directory} cada {self.interval} s...")
+                while True:
+                    await self.scan()
+                    await asyncio.sleep(self.interval)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            for pool in self.pools:
+                pool.shutdown()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Reconcile Citi, Sidera, and Carriles triplets as they land in a directory')
+    parser.add_argument('directory', help='Directory with one subdirectory per site holding citi.csv, sidera.csv and carriles.csv')
+    parser.add_argument('output_dir', help='Directory for the outputs and their metrics')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes, sites reconciled at once (default: 2)')
+    parser.add_argument('--queue-size', type=int, default=4, help='Complete triplets waiting for a worker before scanning pauses (default: 4)')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between scans (default: 2)')
+    parser.add_argument('--once', action='store_true', help='Reconcile the triplets there now and exit')
+    parser.add_argument('--format', dest='output_format', choices=list(lol.OUTPUT_FORMATS), default='xlsx',
+                        help='Output format (default: xlsx)')
+    parser.add_argument('--matcher', choices=sorted(lol.MATCHERS), default='sweep', help='Pairing strategy (default: sweep)')
+    parser.add_argument('--write-only', action='store_true', help='Stream workbooks to disk with openpyxl write-only mode')
+    args = parser.parse_args()
+
+    watcher = Watcher(args.directory, args.output_dir, args.workers, args.queue_size, args.interval,
+                      args.output_format, args.write_only, matcher=args.matcher)
+    try:
+        asyncio.run(watcher.run(args.once))
+    except KeyboardInterrupt:
+        print("Deteniendo...")
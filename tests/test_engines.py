@@ -0,0 +1,136 @@
+import csv
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import lol
+
+# Few cameras (some sharing a 6-char prefix), descriptions and minutes, so
+# that logs crowd into the same components: both sides of midnight and a
+# stretch around noon
+CAMERAS = ["TUN01-C00", "TUN01-C01", "TUN02-C00", "TUN03-C00", "TUN03-C01", "?"]
+DESCRIPTIONS = ["Humo", "Contradirección"]
+MINUTES = [1438, 1439, 0, 1, 719, 720, 722, 300]
+
+def write_exports(directory: str, rng: random.Random, incidents: int = 60) -> Tuple[str, str, str]:
+    """
+    Citi, Sidera and Carriles exports of random incidents, each logged zero
+    to three times by each system a minute or so apart, now and then with
+    an unparseable hour or in another year, and sometimes with a carril
+    alarm that may or may not fall near its logs
+    """
+    citi_rows, sidera_rows, carril_rows = [], [], []
+    for _ in range(incidents):
+        camera = rng.choice(CAMERAS)
+        desc = rng.choice(DESCRIPTIONS)
+        moment = datetime(2024, 1, rng.randint(1, 2)) + timedelta(minutes=rng.choice(MINUTES), seconds=rng.randrange(60))
+        for rows in (citi_rows, sidera_rows):
+            for _ in range(rng.choice([0, 1, 1, 1, 2, 3])):
+                when = moment + timedelta(seconds=rng.randint(-90, 90))
+                year = when.strftime("%Y") if rng.random() > 0.05 else "2025"
+                hour = when.strftime("%H:%M") if rng.random() > 0.05 else "25:61"
+                if rows is citi_rows:
+                    rows.append([camera, when.strftime("%d/%m/%Y %H:%M:%S"), "Incidente", desc, year, hour])
+                else:
+                    rows.append([camera, desc, when.strftime("%d/%m/%Y %H:%M:%S"), year, hour, when.strftime("%S")])
+        if rng.random() < 0.4:
+            when = moment + timedelta(minutes=rng.choice([-2, -1, 0, 1, 2]))
+            prefix = camera[:6] if camera != '?' else rng.choice(CAMERAS[:-1])[:6]
+            carril_rows.append([f"{prefix}L{rng.randint(1, 2)}", desc, when.strftime("%d/%m/%Y"), when.strftime("%H:%M")])
+    rng.shuffle(citi_rows)
+    rng.shuffle(sidera_rows)
+
+    paths = []
+    for name, header, rows in (("citi.csv", ["CameraName", "Start", "IncType", "IncType", "TEXTO AÑOS", "TEXTO HORAS"], citi_rows),
+                               ("sidera.csv", ["Equipo", "Desc. variable", "Fecha", "TEXTO AÑOS", "TEXTO HORAS", "TEXTO SEGUNDOS"], sidera_rows),
+                               ("carriles.csv", ["Equipo", "Desc. variable", "Fecha", "Hora"], carril_rows)):
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="iso-8859-1", newline="") as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(header)
+            writer.writerows(rows)
+        paths.append(path)
+    return tuple(paths)
+
+def outcome(paths: Tuple[str, str, str], **options) -> Dict:
+    """What a reconciliation writes and reports: its rows in output order, the sheets' widths and its counters"""
+    with lol.reconcile(*paths, **options) as result:
+        return {
+            'rows': result.rows,
+            'widths': result.widths,
+            'source_widths': [widths for _, _, _, widths in result.sources],
+            'statuses': result.statuses(),
+            'matches': result.stats.matches,
+            'carril_matches': result.stats.carril_matches,
+            'failed_matches': result.stats.failed_matches,
+        }
+
+def random_cases(tmp_path, seed: int, count: int = 30):
+    rng = random.Random(seed)
+    for case in range(count):
+        directory = tmp_path / str(case)
+        directory.mkdir()
+        yield write_exports(str(directory), rng)
+
+def test_sweep_matches_legacy(tmp_path):
+    # The legacy matcher counts a failed match for every comparison that
+    # fails, the others one reason per log left unpaired, so only the rows
+    # and the other counters have to agree
+    for paths in random_cases(tmp_path, 0):
+        sweep = outcome(paths, matcher="sweep")
+        legacy = outcome(paths, matcher="legacy")
+        del sweep['failed_matches'], legacy['failed_matches']
+        assert sweep == legacy
+
+def test_workers_match_one_process(tmp_path):
+    for paths in random_cases(tmp_path, 1, count=10):
+        for matcher in lol.MATCHERS:
+            assert outcome(paths, matcher=matcher, workers=2) == outcome(paths, matcher=matcher)
+
+def replace_prefix(paths: Tuple[str, str, str], other_paths: Tuple[str, str, str], prefix: str) -> None:
+    """Swap the rows of one 6-char camera prefix for another export's, as when one tunnel is exported again"""
+    for path, other_path in zip(paths, other_paths):
+        with open(path, encoding="iso-8859-1") as f, open(other_path, encoding="iso-8859-1") as other:
+            header, *rows = f.readlines()
+            rows = [row for row in rows if not row.startswith(prefix)]
+            rows += [row for row in other.readlines()[1:] if row.startswith(prefix)]
+        with open(path, "w", encoding="iso-8859-1") as f:
+            f.writelines([header] + rows)
+
+def test_state_matches_a_full_run(tmp_path):
+    rng = random.Random(2)
+    cases = list(random_cases(tmp_path, 2, count=10))
+    reused = 0
+    for paths, other_paths in zip(cases, cases[1:]):
+        for matcher in ("sweep", "optimal"):
+            state_path = os.path.join(os.path.dirname(paths[0]), f"{matcher}.db")
+            # A new state file, then the same inputs again, every stored cluster reused
+            assert outcome(paths, matcher=matcher, state_path=state_path) == outcome(paths, matcher=matcher)
+            with lol.reconcile(*paths, matcher=matcher, state_path=state_path) as result:
+                assert result.stats.incremental['reused'] == result.stats.incremental['stored']
+        replace_prefix(paths, other_paths, rng.choice(CAMERAS[:-1])[:6])
+        for matcher in ("sweep", "optimal"):
+            state_path = os.path.join(os.path.dirname(paths[0]), f"{matcher}.db")
+            with lol.reconcile(*paths, matcher=matcher, state_path=state_path) as result:
+                reused += result.stats.incremental['reused']
+            assert outcome(paths, matcher=matcher, state_path=state_path) == outcome(paths, matcher=matcher)
+    # The clusters of the other prefixes came from the state file
+    assert reused > 0
+
+def test_sqlite_matches_objects(tmp_path):
+    for paths in random_cases(tmp_path, 3):
+        for matcher in ("sweep", "optimal"):
+            assert outcome(paths, matcher=matcher, engine="sqlite") == outcome(paths, matcher=matcher)
+
+def test_parse_workers_match_one_process(tmp_path, monkeypatch):
+    # Small chunks, so that every export is parsed in several pieces
+    monkeypatch.setattr(lol, "PARSE_CHUNK_BYTES", 256)
+    for paths in random_cases(tmp_path, 4, count=10):
+        assert all(len(lol.export_chunks(path)) > 1 for path in paths)
+        for width_sample in (1, 3):
+            assert (outcome(paths, parse_workers=2, width_sample=width_sample)
+                    == outcome(paths, width_sample=width_sample))
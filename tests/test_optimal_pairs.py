@@ -0,0 +1,180 @@
+import heapq
+import os
+import random
+import sys
+from collections import deque
+from typing import List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import lol
+
+MINUTES_PER_DAY = 1440
+
+def make_log(minute: Optional[int], is_citi: bool, hour: Optional[str] = None) -> lol.Log:
+    """A log of one (camera, year, description) component at `minute`, or with an unparseable `hour`"""
+    if hour is None:
+        hour = f"{minute // 60:02d}:{minute % 60:02d}"
+    if is_citi:
+        return lol.Log(["CAM001", "01/01/2024 00:00:00", "Incidente", "Humo", "2024", hour], True)
+    return lol.Log(["CAM001", "Humo", "01/01/2024 00:00:00", "2024", hour, "00"], False)
+
+def difference(citi_log: lol.Log, sidera_log: lol.Log) -> Optional[int]:
+    """Minutes between two logs if they can pair, else None"""
+    if citi_log.minute is None or sidera_log.minute is None:
+        return 0 if citi_log.hour == sidera_log.hour else None
+    apart = lol.minutes_apart(citi_log.minute, sidera_log.minute)
+    return apart if apart <= 1 else None
+
+def score(pairs: List[Tuple[lol.Log, lol.Log]]) -> Tuple[int, int]:
+    """(pairs, -total difference), checking that the pairs are valid"""
+    citi_ids = [id(citi_log) for citi_log, _ in pairs]
+    sidera_ids = [id(sidera_log) for _, sidera_log in pairs]
+    assert len(set(citi_ids)) == len(citi_ids) and len(set(sidera_ids)) == len(sidera_ids)
+    differences = [difference(citi_log, sidera_log) for citi_log, sidera_log in pairs]
+    assert None not in differences
+    return len(pairs), -sum(differences)
+
+def brute_force(citi_logs: List[lol.Log], sidera_logs: List[lol.Log]) -> Tuple[int, int]:
+    """Best (pairs, -total difference) over every assignment"""
+    def best(position: int, used: frozenset) -> Tuple[int, int]:
+        if position == len(citi_logs):
+            return 0, 0
+        result = best(position + 1, used)
+        for other, sidera_log in enumerate(sidera_logs):
+            apart = difference(citi_logs[position], sidera_log)
+            if other not in used and apart is not None:
+                pairs, negative_difference = best(position + 1, used | {other})
+                result = max(result, (pairs + 1, negative_difference - apart))
+        return result
+    return best(0, frozenset())
+
+def min_cost_flow(citi_counts: List[int], sidera_counts: List[int]) -> Tuple[int, int]:
+    """
+    Best (pairs, -total difference) of a whole day of minutes, as a min cost
+    flow from Citi minutes to the Sidera minutes around them, solved with
+    the primal-dual algorithm: no dynamic program and no cut at midnight
+    """
+    minutes = len(citi_counts)
+    source, sink = 0, 1
+    nodes = 2 + 2 * minutes
+    big = sum(citi_counts) + sum(sidera_counts) + 1
+    graph: List[List[int]] = [[] for _ in range(nodes)]
+    # Edges as [to, capacity, cost]; edge e's reverse is e ^ 1
+    edges: List[List[int]] = []
+
+    def add_edge(start: int, end: int, capacity: int, cost: int) -> None:
+        graph[start].append(len(edges))
+        edges.append([end, capacity, cost])
+        graph[end].append(len(edges))
+        edges.append([start, 0, -cost])
+
+    for minute in range(minutes):
+        add_edge(source, 2 + minute, citi_counts[minute], 0)
+        add_edge(2 + minutes + minute, sink, sidera_counts[minute], 0)
+        for delta in (-1, 0, 1):
+            add_edge(2 + minute, 2 + minutes + (minute + delta) % minutes, big, abs(delta) - big)
+
+    # Potentials making every reduced cost non-negative, from the layered graph
+    potential = [0] * nodes
+    for minute in range(minutes):
+        potential[2 + minutes + minute] = -big
+    potential[sink] = -big
+
+    flow = cost = 0
+    while True:
+        distance = [None] * nodes
+        distance[source] = 0
+        heap = [(0, source)]
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if dist > distance[node]:
+                continue
+            for edge in graph[node]:
+                end, capacity, edge_cost = edges[edge]
+                reduced = dist + edge_cost + potential[node] - potential[end]
+                if capacity > 0 and (distance[end] is None or reduced < distance[end]):
+                    distance[end] = reduced
+                    heapq.heappush(heap, (reduced, end))
+        if distance[sink] is None:
+            break
+        for node in range(nodes):
+            if distance[node] is not None:
+                potential[node] += distance[node]
+        if potential[sink] - potential[source] >= 0:
+            break  # More pairs would only add cost
+
+        # Blocking flow along the shortest paths (zero reduced cost edges)
+        while True:
+            level = [None] * nodes
+            level[source] = 0
+            queue = deque([source])
+            while queue:
+                node = queue.popleft()
+                for edge in graph[node]:
+                    end, capacity, edge_cost = edges[edge]
+                    if (capacity > 0 and level[end] is None and distance[end] is not None
+                            and edge_cost + potential[node] - potential[end] == 0):
+                        level[end] = level[node] + 1
+                        queue.append(end)
+            if level[sink] is None:
+                break
+            next_edge = [0] * nodes
+            while True:
+                # Depth-first search for one path, without recursion: paths can be long
+                path: List[int] = []
+                node = source
+                while node != sink:
+                    while next_edge[node] < len(graph[node]):
+                        edge = graph[node][next_edge[node]]
+                        end, capacity, edge_cost = edges[edge]
+                        if (capacity > 0 and level[end] == level[node] + 1
+                                and edge_cost + potential[node] - potential[end] == 0):
+                            break
+                        next_edge[node] += 1
+                    else:
+                        if node == source:
+                            break
+                        # Dead end: back up and skip the edge that led here
+                        edge = path.pop()
+                        node = edges[edge ^ 1][0]
+                        next_edge[node] += 1
+                        continue
+                    path.append(edge)
+                    node = edges[edge][0]
+                if node != sink:
+                    break
+                pushed = min(edges[edge][1] for edge in path)
+                for edge in path:
+                    edges[edge][1] -= pushed
+                    edges[edge ^ 1][1] += pushed
+                flow += pushed
+                cost += pushed * (potential[sink] - potential[source])
+    return flow, -(cost + flow * big)
+
+def test_bursts_match_brute_force():
+    rng = random.Random(0)
+    for _ in range(2000):
+        # A few minutes, sometimes across midnight, and now and then an unparseable hour
+        start = rng.choice([0, 600, MINUTES_PER_DAY - 2])
+        minutes = [(start + rng.randrange(4)) % MINUTES_PER_DAY for _ in range(rng.randint(1, 11))]
+        logs = [make_log(minute, rng.random() < 0.5) for minute in minutes]
+        logs += [make_log(None, rng.random() < 0.5, hour="25:61") for _ in range(rng.randint(0, 1))]
+        citi_logs = [log for log in logs if log.is_citi]
+        sidera_logs = [log for log in logs if not log.is_citi]
+        assert score(lol.optimal_pairs(citi_logs, sidera_logs)) == brute_force(citi_logs, sidera_logs)
+
+def test_whole_day_matches_min_cost_flow():
+    # Every minute taken by both systems, so optimal_pairs has to cut the
+    # cycle of minutes open where some pairs may cross. Alternating
+    # surpluses make the best solutions pair across every boundary
+    rng = random.Random(1)
+    days = [([2, 1] * (MINUTES_PER_DAY // 2), [1, 2] * (MINUTES_PER_DAY // 2))]
+    for _ in range(6):
+        days.append(([rng.randint(1, 4) for _ in range(MINUTES_PER_DAY)], [rng.randint(1, 4) for _ in range(MINUTES_PER_DAY)]))
+    for citi_counts, sidera_counts in days:
+        citi_logs = [make_log(minute, True) for minute in range(MINUTES_PER_DAY) for _ in range(citi_counts[minute])]
+        sidera_logs = [make_log(minute, False) for minute in range(MINUTES_PER_DAY) for _ in range(sidera_counts[minute])]
+        rng.shuffle(citi_logs)
+        rng.shuffle(sidera_logs)
+        assert score(lol.optimal_pairs(citi_logs, sidera_logs)) == min_cost_flow(citi_counts, sidera_counts)